@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark of the Bonsai text rendering of `BonsaiTree`.
+
+Builds wide trees of segments, switches on the segment age, country memberships, and
+operating systems, in which the same condition texts and bids recur all over the tree,
+and times the first rendering of each tree at doubling numbers of segments.
+
+Usage: python benchmarks/bench_render.py [max segments]
+"""
+
+from __future__ import (
+    print_function, division, generators,
+    absolute_import, unicode_literals
+)
+
+import sys
+import time
+
+import networkx as nx
+
+from bonspy import BonsaiTree, PathState
+
+AGES = [(None, 10), (11, 20), (21, 40), (41, None)]
+COUNTRIES = [['GB', 'DE'], ['US', 'BR'], ['FR']]
+OSES = ['linux', 'osx', 'windows']
+
+
+def get_wide_graph(n_segments):
+    g = nx.DiGraph()
+    nodes = iter(range(10 ** 9))
+
+    def add_node(parent, state, edge_data=None, **data):
+        node = next(nodes)
+        g.add_node(node, state=state, **data)
+        if parent is not None:
+            g.add_edge(parent, node, **(edge_data or {}))
+        return node
+
+    def add_default_leaf(parent, state, output):
+        add_node(parent, state, is_default_leaf=True, output=output)
+
+    root = add_node(None, PathState(), split='segment')
+    add_default_leaf(root, PathState(), .05)
+
+    for segment in range(n_segments):
+        segment_state = PathState().child('segment', 10000 + segment)
+        segment_node = add_node(root, segment_state, {'value': 10000 + segment, 'type': 'assignment'},
+                                split='segment.age')
+        add_default_leaf(segment_node, segment_state, .05)
+
+        for age in AGES:
+            age_state = segment_state.child('segment.age', age)
+            age_node = add_node(segment_node, age_state, {'value': age, 'type': 'range'}, split='country')
+            add_default_leaf(age_node, age_state, .05)
+
+            for i, countries in enumerate(COUNTRIES):
+                country_state = age_state.child('country', countries)
+                country_node = add_node(age_node, country_state, {'value': countries, 'type': 'membership'},
+                                        split='os')
+                add_default_leaf(country_node, country_state, .05)
+
+                for j, os in enumerate(OSES):
+                    add_node(country_node, country_state.child('os', os), {'value': os, 'type': 'assignment'},
+                             is_leaf=True, output=.1 * (1 + i + j))
+
+    return g
+
+
+def main(max_segments=1600):
+    print('{:>10} {:>8} {:>10} {:>10} {:>16}'.format('segments', 'nodes', 'lines', 'seconds', 'lines / second'))
+
+    n_segments = 100
+    while n_segments <= max_segments:
+        tree = BonsaiTree(get_wide_graph(n_segments))
+
+        start = time.time()
+        text = tree.bonsai
+        seconds = time.time() - start
+        lines = text.count('\n')
+
+        print('{:>10} {:>8} {:>10} {:>10.3f} {:>16.0f}'.format(n_segments, len(tree), lines, seconds, lines / seconds))
+        n_segments *= 2
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling benchmark of the `BonsaiTree` transforms on deep trees.
+
+Builds comb-shaped trees whose every level assigns an absent value, below a split on a
+slice feature, and times the construction of a `BonsaiTree` from them at doubling depths.
+The total size of all node states grows quadratically with the depth, so linear
+transforms take a constant time per state entry, while transforms that rewrite
+each subtree once per absent value above it take time growing with the depth.
+
+Usage: python benchmarks/bench_transforms.py [max depth]
+"""
+
+from __future__ import (
+    print_function, division, generators,
+    absolute_import, unicode_literals
+)
+
+import sys
+import time
+
+from collections import OrderedDict
+
+import networkx as nx
+
+from bonspy import BonsaiTree
+
+
+def get_comb_graph(depth):
+    g = nx.DiGraph()
+
+    g.add_node('root', split='slice', state=OrderedDict())
+    g.add_node('root_default', is_default_leaf=True, state=OrderedDict(), output=.1)
+    g.add_edge('root', 'root_default')
+    g.add_node('bad', is_leaf=True, state=OrderedDict([('slice', 'bad')]), output=.1)
+    g.add_edge('root', 'bad', value='bad', type='assignment')
+
+    parent, state = 'root', OrderedDict([('slice', 'good')])
+    for level in range(depth + 1):
+        node = 'absent_{}'.format(level)
+        feature = 'f{}'.format(level)
+        g.add_node(node, state=state)
+        g.add_edge(parent, node, value=state[next(reversed(state))], type='assignment')
+
+        if level == depth:
+            g.node[node].update(is_leaf=True, output=.1)
+            break
+
+        g.node[node]['split'] = feature
+        g.add_node(node + '_default', is_default_leaf=True, state=state, output=.1)
+        g.add_edge(node, node + '_default')
+
+        present_state = state.copy()
+        present_state[feature] = 1
+        g.add_node(node + '_present', is_leaf=True, state=present_state, output=.1)
+        g.add_edge(node, node + '_present', value=1, type='assignment')
+
+        parent, state = node, state.copy()
+        state[feature] = None
+
+    return g
+
+
+def main(max_depth=800):
+    print('{:>8} {:>8} {:>14} {:>10} {:>22}'.format(
+        'depth', 'nodes', 'state entries', 'seconds', 'microseconds / entry'
+    ))
+
+    depth = 50
+    while depth <= max_depth:
+        g = get_comb_graph(depth)
+        absence_values = {'f{}'.format(level): (1, 2) for level in range(depth)}
+        entries = sum(len(d['state']) for _, d in g.nodes_iter(data=True))
+
+        start = time.time()
+        BonsaiTree(
+            g, absence_values=absence_values, slice_features=('slice', ), slice_feature_values={'slice': 'good'}
+        )
+        seconds = time.time() - start
+
+        print('{:>8} {:>8} {:>14} {:>10.3f} {:>22.3f}'.format(
+            depth, len(g), entries, seconds, 1e6 * seconds / entries
+        ))
+        depth *= 2
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -6,4 +6,7 @@ from __future__ import (
 )
 
 from bonspy.bonsai import BonsaiTree
+from bonspy.decision_tree import DecisionTreeConverter
+from bonspy.ensemble import EnsembleCompiler
 from bonspy.logistic import LogisticConverter
+from bonspy.state import PathState
@@ -0,0 +1,208 @@
+from abc import ABCMeta, abstractmethod
+import asyncio
+
+from bonspy.graph_builder import Bidder
+from bonspy.state import PathState
+
+try:
+    _run = asyncio.run
+    _get_running_loop = asyncio.get_running_loop
+except AttributeError:  # Python < 3.7, where `get_event_loop` returns the running loop inside coroutines
+    def _run(coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    _get_running_loop = asyncio.get_event_loop
+
+
+def _run_blocking(coroutine):
+    if asyncio._get_running_loop() is not None:
+        coroutine.close()  # never awaited otherwise
+        raise RuntimeError(
+            'AsyncBidder cannot bid synchronously inside a running event loop, '
+            'await `compute_bids_async` instead.'
+        )
+    return _run(coroutine)
+
+
+class ScoringClient(metaclass=ABCMeta):
+    """
+    Interface of the asynchronous scoring clients used by `AsyncBidder`.
+
+    A client receives a batch of leaf states, with `PathState` states converted to
+    OrderedDicts so that they can be serialized, and returns one score per state,
+    in the same order. A score is either a number, which `AsyncBidder` multiplies
+    with its `base_bid`, or a dict of node attributes (e.g. {'output': 1.2}) that is
+    written onto the leaf as is.
+    """
+
+    @abstractmethod
+    async def score(self, states):
+        pass
+
+
+class AsyncBidder(Bidder):
+
+    def __init__(self, client, base_bid=1., batch_size=256, max_delay=0.005, max_in_flight=4,
+                 max_retries=3, retry_delay=0.05, retry_exceptions=(Exception,), **kwargs):
+        """
+        :param client: ScoringClient, async client of the scoring service
+        :param base_bid: float, multiplied with numeric scores returned by the client
+        :param batch_size: int, maximum number of leaf states sent to the client in one request
+        :param max_delay: float, seconds to wait for a batch to fill up before it is sent anyway
+        :param max_in_flight: int, maximum number of concurrent requests to the client
+        :param max_retries: int, number of times a failed batch is retried before giving up
+        :param retry_delay: float, seconds to wait before the first retry, doubled on every further retry
+        :param retry_exceptions: tuple, exception types that trigger a retry
+        """
+        self.client = client
+        self.base_bid = base_bid
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.retry_exceptions = retry_exceptions
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def bid_leaves(self, graph, leaves):
+        """
+        Bids on `leaves` in batched, concurrent requests, e.g. when called by `GraphBuilder`.
+        Blocks until all leaves are bid on, so it cannot be called inside a running event loop.
+        """
+        return _run_blocking(self.compute_bids_async(graph, leaves))
+
+    def get_bid(self, *args, **kwargs):
+        graph = kwargs['graph']
+        leaf = kwargs['leaf']
+        scores = _run_blocking(self._score_batch([_get_client_state(graph.node[leaf]['state'])]))
+        return self._get_output_dict(scores[0])
+
+    async def compute_bids_async(self, graph, leaves=None):
+        """
+        :param graph: NetworkX DiGraph
+        :param leaves: (optional) iterable of the leaves to bid on, all leaves of `graph` by default
+        """
+        if leaves is None:
+            leaves = self.get_leaves(graph)
+        queue = asyncio.Queue(maxsize=2 * self.batch_size * self.max_in_flight)
+
+        producer = asyncio.ensure_future(self._produce(leaves, queue))
+        consumer = asyncio.ensure_future(self._consume(graph, queue))
+        try:
+            # a failing producer never queues the end of stream, so it is watched alongside the consumer:
+            done, _ = await asyncio.wait({producer, consumer}, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()  # re-raises the exception of a failed task
+        finally:
+            for task in (producer, consumer):
+                task.cancel()
+            await asyncio.gather(producer, consumer, return_exceptions=True)
+
+        return graph
+
+    @staticmethod
+    async def _produce(leaves, queue):
+        for leaf in leaves:
+            await queue.put(leaf)
+        await queue.put(None)  # end of stream
+
+    async def _consume(self, graph, queue):
+        slots = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        exhausted = False
+
+        try:
+            while not exhausted:
+                # wait for a free slot first so that leaves pile up in the queue meanwhile
+                # and the next batch goes out as full as possible:
+                await slots.acquire()
+
+                batch, exhausted = await self._get_batch(queue)
+                if not batch:
+                    slots.release()
+                    continue
+
+                task = asyncio.ensure_future(self._bid_batch(graph, batch))
+                task.add_done_callback(lambda _: slots.release())
+                tasks.add(task)
+                tasks = self._check_done(tasks)
+
+            if tasks:
+                await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    @staticmethod
+    def _check_done(tasks):
+        done = {task for task in tasks if task.done()}
+        for task in done:
+            task.result()  # raises if the batch failed for good
+        return tasks - done
+
+    async def _get_batch(self, queue):
+        loop = _get_running_loop()
+        leaf = await queue.get()
+        if leaf is None:
+            return [], True
+
+        batch = [leaf]
+        deadline = loop.time() + self.max_delay
+
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            try:
+                leaf = queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+
+            if leaf is None:
+                return batch, True
+            batch.append(leaf)
+
+        return batch, False
+
+    async def _bid_batch(self, graph, batch):
+        states = [_get_client_state(graph.node[leaf]['state']) for leaf in batch]
+        scores = await self._score_batch(states)
+
+        for leaf, score in zip(batch, scores):
+            output_dict = self._get_output_dict(score)
+            for key, value in output_dict.items():
+                graph.node[leaf][key] = value
+
+    async def _score_batch(self, states):
+        attempt = 0
+        while True:
+            try:
+                scores = await self.client.score(states)
+                break
+            except self.retry_exceptions:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+                attempt += 1
+
+        scores = list(scores)
+        if len(scores) != len(states):
+            raise ValueError(
+                'Scoring client returned {} scores for {} leaf states.'.format(len(scores), len(states))
+            )
+
+        return scores
+
+    def _get_output_dict(self, score):
+        if isinstance(score, dict):
+            return score
+        else:
+            return {'output': self.base_bid * score}
+
+
+def _get_client_state(state):
+    return state.to_dict() if isinstance(state, PathState) else state
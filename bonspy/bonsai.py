@@ -6,23 +6,70 @@ from __future__ import (
 )
 
 import base64
+import math
 
 from collections import deque, OrderedDict
-from functools import cmp_to_key
+from functools import wraps
 
 import networkx as nx
 
+from bonspy.columnar import get_leaf_table, set_leaf_values
 from bonspy.features import compound_features, get_validated, objects
-from bonspy.utils import compare_vectors, is_absent_value
+from bonspy.state import rewrite_state
+from bonspy.utils import is_absent_value
+from bonspy.writer import write_bonsai
 
 try:
     basestring
 except NameError:
     basestring = str
 
+try:
+    from sys import intern
+except ImportError:  # Python 2
+    pass
+
 RANGE_EPSILON = 1
 
 
+def _invalidating(method):
+    """
+    Wraps a graph mutator of `nx.DiGraph` so that it drops the cached rendering of a `BonsaiTree`.
+    """
+    @wraps(method)
+    def mutator(self, *args, **kwargs):
+        self.invalidate_bonsai()
+        return method(self, *args, **kwargs)
+
+    return mutator
+
+
+def _get_typed_key(value):
+    """
+    :return: Hashable key of `value` that tells apart values that compare equal but render
+        differently, such as 1 and 1.0, also as items of a tuple or list.
+    """
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple((type(item), item) for item in value)
+    return type(value), value
+
+
+class _CommonPrefixKey(object):
+    """
+    Sort key wrapper that compares tuples of different lengths only on their common prefix,
+    so that a sibling whose state holds more features does not sort after an otherwise equal one.
+    """
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        length = min(len(self.key), len(other.key))
+        return self.key[:length] < other.key[:length]
+
+
 class BonsaiTree(nx.DiGraph):
     """
     A NetworkX DiGraph (directed graph) subclass that knows how to print
@@ -32,7 +79,10 @@ class BonsaiTree(nx.DiGraph):
 
     https://github.com/markovianhq/bonspy
 
-    The Bonsai text representation of this tree is stored in its `bonsai` attribute.
+    The Bonsai text representation of this tree is rendered on first access of its `bonsai`
+    attribute, and cached along with its base64 encoding `bonsai_encoded` until the tree is
+    modified through its methods, e.g. `add_edge`, `remove_node`, or `set_leaf_values`.
+    Call `invalidate_bonsai` after modifying node or edge attributes directly.
 
     :param graph: (optional) NetworkX graph to be exported to Bonsai.
     :param feature_order: (optional), iterable required when a parent node is split on more than one feature.
@@ -52,29 +102,78 @@ class BonsaiTree(nx.DiGraph):
     :param slice_feature_values: (optional) dict, slice_feature -> feature values to not be sliced off the graph.
     """
 
+    _bonsai = None
+    _bonsai_encoded = None
+
+    add_node = _invalidating(nx.DiGraph.add_node)
+    add_nodes_from = _invalidating(nx.DiGraph.add_nodes_from)
+    remove_node = _invalidating(nx.DiGraph.remove_node)
+    remove_nodes_from = _invalidating(nx.DiGraph.remove_nodes_from)
+    add_edge = _invalidating(nx.DiGraph.add_edge)
+    add_edges_from = _invalidating(nx.DiGraph.add_edges_from)
+    remove_edge = _invalidating(nx.DiGraph.remove_edge)
+    remove_edges_from = _invalidating(nx.DiGraph.remove_edges_from)
+    clear = _invalidating(nx.DiGraph.clear)
+
     def __init__(self, graph=None, feature_order=(), feature_value_order={}, absence_values=None,
                  slice_features=None, slice_feature_values=(), **kwargs):
+        self._fragments = {}  # also used by bare instances that only render, see `LogisticConverter.iter_bonsai`
         if graph is not None:
             super(BonsaiTree, self).__init__(graph)
-            self.feature_order = self._convert_to_dict(feature_order)
-            self.feature_value_order = self._get_feature_value_order(feature_value_order)
-            self.absence_values = absence_values or {}
-            self.slice_features = slice_features or ()
-            self.slice_feature_values = slice_feature_values or {}
-            for key, value in kwargs.items():
-                setattr(self, key, value)
-            self._transform_splits()
-            self._slice_graph()
-            self._replace_absent_values()
-            self._remove_missing_compound_features()
-            self._validate_feature_values()
-            self._assign_indent()
-            self._assign_condition()
-            self._handle_switch_statements()
-            self.bonsai = ''.join(self._tree_to_bonsai())
+            self._transform(feature_order, feature_value_order, absence_values, slice_features,
+                            slice_feature_values, **kwargs)
         else:
             super(BonsaiTree, self).__init__(**kwargs)
 
+    @classmethod
+    def from_graph(cls, graph, copy=True, **kwargs):
+        """
+        :param graph: NetworkX DiGraph to be exported to Bonsai.
+        :param copy: (optional) bool, whether to copy `graph` first, as `BonsaiTree(graph)` does.
+            If False, the tree takes over the node, edge, and graph attribute dicts of `graph`
+            and transforms them in place, which saves the memory of the copy. The input graph is
+            consumed: it is left empty, and objects it referenced, e.g. node attribute dicts, are
+            modified. Do not pass graphs that are still in use elsewhere, e.g. a converter's graph
+            that is updated later on.
+        :param kwargs: (optional) Further arguments of `BonsaiTree`, e.g. `feature_order`.
+        :return: BonsaiTree
+        """
+        if copy:
+            return cls(graph, **kwargs)
+
+        if not graph.is_directed() or graph.is_multigraph():
+            raise ValueError('Only DiGraphs can be consumed by BonsaiTree, got {}.'.format(type(graph).__name__))
+
+        tree = cls()
+        tree.graph, tree.node, tree.pred = graph.graph, graph.node, graph.pred
+        tree.adj = tree.succ = tree.edge = graph.succ
+        graph.graph, graph.node, graph.pred = {}, {}, {}
+        graph.adj = graph.succ = graph.edge = {}
+
+        tree._transform(**kwargs)
+        return tree
+
+    def _transform(self, feature_order=(), feature_value_order={}, absence_values=None,
+                   slice_features=None, slice_feature_values=(), **kwargs):
+        self.feature_order = self._convert_to_dict(feature_order)
+        self.feature_value_order = self._get_feature_value_order(feature_value_order)
+        self._feature_order_fallback = self._get_order_fallback(self.feature_order)
+        self._value_order_fallbacks = {
+            feature: self._get_order_fallback(order) for feature, order in self.feature_value_order.items()
+        }
+        self._sorted_successors = {}
+        self.absence_values = absence_values or {}
+        self.slice_features = slice_features or ()
+        self.slice_feature_values = slice_feature_values or {}
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        self._index_tree()
+        self._transform_splits()
+        self._slice_graph()
+        self._replace_absent_values()
+        self._remove_missing_compound_features()
+        self._validate_feature_values()
+
     @staticmethod
     def _convert_to_dict(feature_order):
         for index, f in enumerate(feature_order):
@@ -86,9 +185,51 @@ class BonsaiTree(nx.DiGraph):
     def _get_feature_value_order(self, feature_value_order):
         return {feature: self._convert_to_dict(list_) for feature, list_ in feature_value_order.items()}
 
+    @property
+    def bonsai(self):
+        if self._bonsai is None:
+            self._bonsai = ''.join(self._tree_to_bonsai())
+        return self._bonsai
+
     @property
     def bonsai_encoded(self):
-        return base64.b64encode(self.bonsai.encode('ascii')).decode()
+        if self._bonsai_encoded is None:
+            self._bonsai_encoded = base64.b64encode(self.bonsai.encode('ascii')).decode()
+        return self._bonsai_encoded
+
+    def write(self, fp, encoding='text'):
+        """
+        Writes the Bonsai text to a binary file object line by line, without joining it
+        into `bonsai` or `bonsai_encoded` first. Text that is cached already is written as is.
+
+        :param fp: binary file object, e.g. opened with mode 'wb'.
+        :param encoding: (optional) 'text', 'base64' (the format of `bonsai_encoded`), or 'gzip'.
+        """
+        lines = [self._bonsai] if self._bonsai is not None else self._tree_to_bonsai()
+        write_bonsai(lines, fp, encoding=encoding)
+
+    def invalidate_bonsai(self):
+        """
+        Drops the cached Bonsai text and order of siblings, so that the tree is rendered anew,
+        e.g. after direct edits of node states, on the next access of `bonsai`.
+        """
+        self._bonsai = None
+        self._bonsai_encoded = None
+        self._sorted_successors = {}  # the order of siblings depends on the structure and states
+
+    def get_leaf_table(self, features=None, as_frame=False):
+        """
+        Exports all leaves and default leaves as a columnar table, see `bonspy.columnar.get_leaf_table`.
+        """
+        return get_leaf_table(self, features=features, as_frame=as_frame)
+
+    def set_leaf_values(self, leaves, values, key='output'):
+        """
+        Writes one value per leaf onto the leaves and updates the Bonsai text,
+        see `bonspy.columnar.set_leaf_values`.
+        """
+        set_leaf_values(self, leaves, values, key=key)
+        self.invalidate_bonsai()
 
     def _transform_splits(self):
         root_id = self._get_root()
@@ -107,8 +248,34 @@ class BonsaiTree(nx.DiGraph):
                         self.node[node_id]['split'][child_id] = split
 
     def _slice_graph(self):
+        if not self.slice_features:
+            return  # nothing to slice, and no states to rewrite
+
+        split_features = self._get_split_features()
+
         for slice_feature in self.slice_features:
-            self._slice_feature_out_of_graph(slice_feature)
+            if slice_feature in split_features:
+                self._slice_feature_out_of_graph(slice_feature)
+
+        # slice features only occur in the states below their splits, so they are removed from all states at once:
+        self._remove_features_from_states(self.slice_features)
+
+    def _get_split_features(self):
+        split_features = set()
+        for data in self.node.values():
+            split_features.update(data.get('split', {}).values())
+
+        return split_features
+
+    def _remove_features_from_states(self, features):
+        memo = {}
+        for data in self.node.values():
+            if data.get('state'):
+                data['state'] = rewrite_state(data['state'], self._get_feature_remover(features), memo)
+
+    @staticmethod
+    def _get_feature_remover(features):
+        return lambda feature, value: None if feature in features else (feature, value)
 
     def _slice_feature_out_of_graph(self, slice_feature):
         root_id = self._get_root()
@@ -148,7 +315,7 @@ class BonsaiTree(nx.DiGraph):
                     node_id, slice_feature, normal_child, default_child, other_children
                 )
             else:
-                self._splice_out_node(normal_child, slice_feature, slicing=True)
+                self._skip_node(normal_child, slicing=True)
 
         except StopIteration:  # slice feature value not present in subtree
             other_children = [n for n in self.successors_iter(node_id) if n != default_child]
@@ -175,7 +342,7 @@ class BonsaiTree(nx.DiGraph):
         while queue:
             current_node = queue.popleft()
             next_nodes = self.successors(current_node)
-            self.remove_node(current_node)
+            self._remove_tree_node(current_node)
             queue.extend(next_nodes)
 
     def _get_normal_child(self, node_id, slice_feature):
@@ -188,42 +355,29 @@ class BonsaiTree(nx.DiGraph):
                                                  default_child, other_children):
         if not other_children:
             del self.node[node_id]['split']
-            self._remove_feature_from_state(node_id, slice_feature)
             self.node[node_id] = self.node[normal_child].copy()
 
-            self.remove_edge(node_id, default_child)
-            self.remove_node(default_child)
+            self._remove_tree_edge(node_id, default_child)
+            self._remove_tree_node(default_child)
         else:
             del self.node[node_id]['split'][normal_child]
-            self._remove_feature_from_state(node_id, slice_feature)
             self.node[default_child] = self.node[normal_child].copy()
             del self.node[default_child]['is_leaf']
             self.node[default_child]['is_default_leaf'] = True
 
-        self.remove_edge(node_id, normal_child)
-        self.remove_node(normal_child)
-
-    def _remove_feature_from_state(self, source, feature):
-        for node_id in self.bfs_nodes(source):
-            try:
-                del self.node[node_id]['state'][feature]
-            except KeyError:  # node_id is default leaf
-                pass
-
-    def _splice_out_node(self, source, feature, slicing=False):
-        self._remove_feature_from_state(source, feature)
-        self._skip_node(source, slicing)
+        self._remove_tree_edge(node_id, normal_child)
+        self._remove_tree_node(normal_child)
 
     def _skip_node(self, node_id, slicing):
-        parent_id = next(iter(self.predecessors_iter(node_id)))
+        parent_id = self._parents[node_id]
 
         if slicing:
             self._skip_node_slicing(node_id, parent_id)
         else:
             self._skip_node_non_slicing(node_id, parent_id)
 
-        self.remove_edge(parent_id, node_id)
-        self.remove_node(node_id)
+        self._remove_tree_edge(parent_id, node_id)
+        self._remove_tree_node(node_id)
 
     def _cut_single_default_child(self, parent_id, default_child):
         if not self.node[parent_id].get('is_default_node'):
@@ -232,27 +386,42 @@ class BonsaiTree(nx.DiGraph):
             self.node[parent_id]['is_leaf'] = True
         else:
             self.node[parent_id] = self.node[default_child]
-        self.remove_node(default_child)
+        self._remove_tree_node(default_child)
 
     def _replace_absent_values(self):
+        """
+        Replaces absent values top-down: the replacements made above a node are passed on to it
+        and applied to its state together with its own, so that every state is rebuilt at most once.
+        """
         root_id = self._get_root()
+        replacements = {}  # node id -> ({feature: absent feature} to apply in its subtree, rewrite memo)
 
         for parent_id, child_id in nx.bfs_edges(self, root_id):
+            replacement, memo = replacements.get(parent_id, ({}, None))
+            state = self.node[child_id]['state']
+
             try:
-                feature = next(reversed(self.node[child_id]['state']))
+                feature = next(reversed(state))
             except StopIteration:
-                continue  # node_id is root_id
-
-            value = self.node[child_id]['state'][feature]
+                feature = None  # state is empty
 
-            if self.absence_values.get(feature) and value is None:
+            if feature is not None and feature not in replacement and \
+                    self.absence_values.get(feature) and state[feature] is None:
                 self._replace_absent_value_split(parent_id, child_id, feature)
                 self._replace_absent_value_edge(parent_id, child_id, feature)
-                self._replace_absent_value_state(child_id, feature)
+                replacement = dict(replacement)
+                replacement[feature] = self._get_absent_feature(feature)
+                memo = {}
+
+            if replacement:
+                self.node[child_id]['state'] = rewrite_state(state, self._get_absent_value_replacer(replacement), memo)
+                replacements[child_id] = replacement, memo
+
+    def _get_absent_feature(self, feature):
+        return tuple(feature for value in self.absence_values[feature])
 
     def _replace_absent_value_split(self, parent_id, child_id, feature):
-        values = self.absence_values[feature]
-        self.node[parent_id]['split'][child_id] = tuple(feature for value in values)
+        self.node[parent_id]['split'][child_id] = self._get_absent_feature(feature)
 
     def _replace_absent_value_edge(self, parent_id, child_id, feature):
         values = self.absence_values[feature]
@@ -261,37 +430,49 @@ class BonsaiTree(nx.DiGraph):
         self.edge[parent_id][child_id]['type'] = ['assignment' for value in values]
         self.edge[parent_id][child_id]['is_negated'] = [True for value in values]
 
-    def _replace_absent_value_state(self, source, feature):
-        absent_values = self.absence_values[feature]
-
-        for node_id in self.bfs_nodes(source):
-            state = self.node[node_id]['state']
-            absent_feature = tuple(feature for value in absent_values)
-
-            state = OrderedDict(
-                [(k, v) if k != feature else (absent_feature, absent_values) for k, v in state.items()]
-            )
+    def _get_absent_value_replacer(self, replacement):
+        def replace(feature, value):
+            if feature in replacement:
+                return replacement[feature], self.absence_values[feature]
+            else:
+                return feature, value
 
-            self.node[node_id]['state'] = state
+        return replace
 
     def _remove_missing_compound_features(self):
+        """
+        Splices out the nodes assigning None to a compound feature. The features removed
+        above a node are queued along with it and removed from its state when it is reached,
+        so that every state is rewritten at most once.
+        """
         root_id = self._get_root()
+        queue = deque([(root_id, (), None)])
+
+        while queue:
+            node_id, removed_features, memo = queue.popleft()
+            state = self.node[node_id]['state']
+            if removed_features:
+                state = self.node[node_id]['state'] = rewrite_state(
+                    state, self._get_feature_remover(removed_features), memo
+                )
 
-        for node_id in self.bfs_nodes(root_id):
             try:
-                feature = next(reversed(self.node[node_id]['state']))
+                feature = next(reversed(state))
             except StopIteration:
-                continue  # node_id is root_id
+                feature = None  # node_id is root_id
 
-            value = self.node[node_id]['state'][feature]
+            is_missing = feature is not None and self._is_compound_attribute(feature) and state[feature] is None
+            if is_missing:
+                removed_features += (feature, )
+                memo = {}
 
-            is_compound_attribute = self._is_compound_attribute(feature)
+            queue.extend((child_id, removed_features, memo) for child_id in self.successors_iter(node_id))
 
-            if is_compound_attribute and value is None:
+            if is_missing:
                 if self.node[node_id].get('is_leaf'):
-                    self.remove_node(node_id)
+                    self._remove_tree_node(node_id)
                 else:
-                    self._splice_out_node(node_id, feature)
+                    self._skip_node(node_id, slicing=False)
 
         self._remove_disconnected_nodes()
         self._prune_redundant_default_leaves()
@@ -317,8 +498,8 @@ class BonsaiTree(nx.DiGraph):
             if self.node[child_id].get('is_default_leaf'):
                 continue
             else:
-                self.add_edge(parent_id, child_id, attr_dict=edge_data)
-                self.remove_edge(node_id, child_id)
+                self._add_tree_edge(parent_id, child_id, attr_dict=edge_data)
+                self._remove_tree_edge(node_id, child_id)
         del self.node[parent_id]['split'][node_id]
         self._update_split(parent_id, node_id)
 
@@ -328,9 +509,9 @@ class BonsaiTree(nx.DiGraph):
                 self._update_parent_default_leaf(parent_id, child_id)
                 del self.node[child_id]
             else:
-                self.add_edge(parent_id, child_id, attr_dict=edge_data)
+                self._add_tree_edge(parent_id, child_id, attr_dict=edge_data)
                 self._update_split(parent_id, node_id, child_id=child_id)
-                self.remove_edge(node_id, child_id)
+                self._remove_tree_edge(node_id, child_id)
         del self.node[parent_id]['split'][node_id]
 
     def _update_parent_default_leaf(self, parent_id, new_default):
@@ -347,16 +528,16 @@ class BonsaiTree(nx.DiGraph):
             self.node[parent_id]['split'].update(node_split)
 
     def _remove_disconnected_nodes(self):
-        node_ids = self._get_disconnected_nodes()
-
-        while node_ids:
-            self.remove_nodes_from(node_ids)
-
-            node_ids = self._get_disconnected_nodes()
+        # removing isolated nodes leaves the remaining nodes' edges as they are, so one pass suffices:
+        for node_id in self._get_disconnected_nodes():
+            self._remove_tree_node(node_id)
 
     def _get_disconnected_nodes(self):
+        # only nodes that lost their parent can have become disconnected:
         root = self._get_root()
-        node_ids = [n for n in self.nodes_iter() if not self.successors(n) and not self.predecessors(n) and n != root]
+        node_ids = [
+            n for n in self._orphans if n in self.node and not self.succ[n] and not self.pred[n] and n != root
+        ]
         return node_ids
 
     def _prune_redundant_default_leaves(self):
@@ -365,7 +546,7 @@ class BonsaiTree(nx.DiGraph):
 
         while queue:
             node_id = queue.popleft()
-            parent_id = next(iter(self.predecessors_iter(node_id)))
+            parent_id = self._parents[node_id]
 
             if not self.node[parent_id].get('is_default_node'):
                 self.node[parent_id] = self.node[node_id]
@@ -375,7 +556,7 @@ class BonsaiTree(nx.DiGraph):
                 self.node[parent_id] = self.node[node_id]
                 queue.extend(parent_id)
 
-            self.remove_node(node_id)
+            self._remove_tree_node(node_id)
 
     def _get_only_child_default_leaves(self):
         default_edges = ((p, c) for (p, c) in self.edges_iter() if self.node[c].get('is_default_leaf'))
@@ -383,16 +564,21 @@ class BonsaiTree(nx.DiGraph):
         return only_child_default_leaves
 
     def _has_only_one_child(self, parent_id):
-        return len(self.successors(parent_id)) == 1
+        return len(self.succ[parent_id]) == 1
 
     def _validate_feature_values(self):
         self._validate_node_states()
         self._validate_edge_values()
 
     def _validate_node_states(self):
-        for node, data in self.nodes_iter(data=True):
-            for feature, value in data.get('state', {}).items():
-                self.node[node]['state'][feature] = get_validated(feature, value)
+        memo = {}
+        for data in self.node.values():
+            if data.get('state'):
+                data['state'] = rewrite_state(data['state'], self._validate_item, memo)
+
+    @staticmethod
+    def _validate_item(feature, value):
+        return feature, get_validated(feature, value)
 
     def _validate_edge_values(self):
         for parent, child, data in self.edges_iter(data=True):
@@ -405,178 +591,137 @@ class BonsaiTree(nx.DiGraph):
             except KeyError:
                 pass  # edge has no value attribute, nothing to validate
 
-    def _get_root(self):
-        for node in self.nodes():
-            if len(self.predecessors(node)) == 0:
-                return node
-
-    def _assign_indent(self):
-        root = self._get_root()
-        queue = deque([root])
-
-        self.node[root]['indent'] = ''
-
-        while queue:
-            node = queue.popleft()
-            indent = self.node[node]['indent']
-
-            next_nodes = self.successors(node)
-            for node in next_nodes:
-                self.node[node]['indent'] = indent + '\t'
-
-            next_nodes = sorted(next_nodes, key=self._sort_key)
-
-            queue.extend(next_nodes)
-
-    @property
-    def _sort_key(self):
-        comparison_function = self._get_comparison_function()
-        return cmp_to_key(comparison_function)
+    def _index_tree(self):
+        """
+        Records the root, the parent of every other node, and the nodes without a parent
+        besides the root. `_add_tree_edge`, `_remove_tree_edge`, and `_remove_tree_node`
+        keep this index up to date while the graph is transformed.
+        """
+        self._root = None
+        self._parents = {}
+        self._orphans = set()
+
+        for node in self.nodes_iter():
+            parents = self.pred[node]
+            if parents:
+                self._parents[node] = next(iter(parents))
+            elif self._root is None:
+                self._root = node
+            else:
+                self._orphans.add(node)
 
-    def _get_comparison_function(self):
-        _get_default_extended_vector = self._get_default_extended_vector
+    def _get_root(self):
+        root = getattr(self, '_root', None)
+        if root is None or root not in self.pred or self.pred[root]:  # graph changed outside the helpers
+            root = self._root = next((n for n in self.nodes_iter() if not self.pred[n]), None)
+        return root
 
-        def compare_nodes(x, y):
-            x_ = _get_default_extended_vector(x)
-            y_ = _get_default_extended_vector(y)
+    def _add_tree_edge(self, parent_id, child_id, attr_dict=None):
+        self.add_edge(parent_id, child_id, attr_dict=attr_dict)
+        self._parents[child_id] = parent_id
+        self._orphans.discard(child_id)
 
-            return compare_vectors(x_, y_)
+    def _remove_tree_edge(self, parent_id, child_id):
+        self.remove_edge(parent_id, child_id)
+        self._remove_parent(child_id, parent_id)
 
-        return compare_nodes
+    def _remove_tree_node(self, node_id):
+        for child_id in self.successors(node_id):
+            self._remove_parent(child_id, node_id)
 
-    def _get_default_extended_vector(self, x):
-        vec = [self.node[x].get('is_default_leaf', False), self.node[x].get('is_default_node', False)]
-        vec += self._get_sorted_values(x)
+        self.remove_node(node_id)
+        self._parents.pop(node_id, None)
+        self._orphans.discard(node_id)
+        if node_id == self._root:
+            self._root = None
+
+    def _remove_parent(self, child_id, parent_id):
+        if self._parents.get(child_id) == parent_id:
+            del self._parents[child_id]
+            self._orphans.add(child_id)
+
+    def _get_sorted_successors(self, node):
+        """
+        :return: List of the children of `node` in output order, sorted once and cached.
+        """
+        try:
+            return self._sorted_successors[node]
+        except KeyError:
+            pass
 
-        return vec
+        children = self.successors(node)
+        keys = dict((child, self._get_sort_key(child)) for child in children)
+        children = sorted(children, key=lambda child: _CommonPrefixKey(keys[child]))
+        self._sorted_successors[node] = children
+        return children
 
-    def _get_sorted_values(self, x):
-        values = []
+    def _get_sort_key(self, node):
+        data = self.node[node]
+        key = [bool(data.get('is_default_leaf', False)), bool(data.get('is_default_node', False))]
 
-        for feature, value in self.node[x]['state'].items():
-            feature_key = self._get_feature_order_key(feature)
-            value_key = self._get_value_order_key(feature, value)
-            values.append(feature_key)
-            values.append(value_key)
+        for feature, value in data['state'].items():
+            key.append(self._get_feature_order_key(feature))
+            key.append(self._get_value_order_key(feature, value))
 
-        return values
+        return tuple(key)
 
     def _get_feature_order_key(self, feature):
-        feature_order = self.feature_order
-        feature_order_key = self._get_order_key(dict_=feature_order, key=feature)
-        return feature_order_key
+        return self.feature_order.get(feature, self._feature_order_fallback)
 
     def _get_value_order_key(self, feature, value):
-        value_order = self.feature_value_order.get(feature, {})
-        value_order_key = self._get_order_key(dict_=value_order, key=value)
-        return value_order_key
+        value_order = self.feature_value_order.get(feature)
+        if not value_order:
+            return 0
+        try:
+            return value_order[value]
+        except KeyError:
+            return self._value_order_fallbacks[feature]
 
     @staticmethod
-    def _get_order_key(dict_, key):
-        order_key = 0
-        if not dict_ == {}:
-            try:
-                order_key = dict_[key]
-            except KeyError:
-                order_key = max(dict_.values()) + 1
-
-        return order_key
-
-    def _assign_condition(self):
-        root = self._get_root()
-        queue = deque([root])
-
-        while queue:
-            node = queue.popleft()
-
-            next_nodes = self.successors(node)
-            next_nodes = sorted(next_nodes, key=self._sort_key)
-
-            for n_i, n in enumerate(next_nodes):
-                if n_i == 0:
-                    condition = 'if'
-                elif n_i == len(next_nodes) - 1:
-                    condition = 'else'
-                else:
-                    condition = 'elif'
-
-                self.node[n]['condition'] = condition
-
-            queue.extend(next_nodes)
-
-    def _handle_switch_statements(self):
-        self._assign_switch_headers()
-        self._adapt_switch_indentation()
-        self._adapt_switch_header_indentation()
-
-    def _assign_switch_headers(self):
-        root = self._get_root()
-        stack = deque(self._get_sorted_out_edges(root))
-
-        while stack:
-            parent, child = stack.popleft()
-
-            next_edges = self._get_sorted_out_edges(child)
-            stack.extendleft(next_edges[::-1])  # extendleft reverses order!
-
-            type_ = self.edge[parent][child].get('type')
-
-            if type_ == 'range' and len(set(self.node[parent]['split'].values())) == 1:
-                feature = self._get_feature(parent, child, state_node=parent)
-
-                header = 'switch {}:'.format(feature)  # appropriate indentation added later
-
-                self.node[parent]['switch_header'] = header
-
-    def _adapt_switch_indentation(self):
-        switch_header_nodes = [n for n, d in self.nodes_iter(data=True) if d.get('switch_header')]
-        stack = deque(switch_header_nodes)
-
-        while stack:
-            node = stack.popleft()
-            next_nodes = self.successors(node)
-            stack.extendleft(next_nodes[::-1])  # extendleft reverses order!
-
-            self.node[node]['indent'] += '\t'
-
-    def _adapt_switch_header_indentation(self):
-        for node, data in self.nodes_iter(data=True):
-            if data.get('switch_header'):
-                try:
-                    parent = self.predecessors(node)[0]
-                except IndexError:  # node is root
-                    continue
-                parent_indent = self.node[parent]['indent']
-                switch_header = self.node[node]['switch_header']
-                self.node[node]['switch_header'] = parent_indent + '\t' + switch_header
-
-    def _get_sorted_out_edges(self, node):
-        edges = self.out_edges_iter(node)
-        edges = sorted(edges, key=lambda x: self._sort_key(x[1]))
-        return edges
-
-    def _get_output_text(self, node):
+    def _get_order_fallback(dict_):
+        # position of keys missing from a non-empty order: after all listed keys
+        return max(dict_.values()) + 1 if dict_ else 0
+
+    def _get_switch_header(self, node):
+        """
+        :return: Switch statement (without indentation) that `node` opens if it is split on
+            a single range feature, otherwise None.
+        """
+        for child in self._get_sorted_successors(node):
+            if self.edge[node][child].get('type') == 'range' and len(set(self.node[node]['split'].values())) == 1:
+                return 'switch {}:'.format(self._get_feature(node, child, state_node=node))
+
+        return None
+
+    def _get_output_text(self, node, indent):
         out_text = ''
         if self.node[node].get('is_leaf') or self.node[node].get('is_default_leaf'):
             if not self.node[node].get('is_smart'):
-                out_text = self._get_leaf_output(node)
+                out_text = self._get_leaf_output(node, indent)
             else:
-                name_line = self._get_name_line(node)
-                value_line = self._get_value_line(node)
+                name_line = self._get_name_line(node, indent)
+                value_line = self._get_value_line(node, indent)
                 out_text = name_line + value_line
 
         return out_text
 
-    def _get_leaf_output(self, node):
-        out_indent = self.node[node]['indent']
+    def _get_leaf_output(self, node, out_indent):
         out_value = self.node[node]['output']
-        out_text = '{indent}{value:.4f}\n'.format(indent=out_indent, value=out_value)
+        if out_value is None or out_value != out_value:  # NaN would never be found in the fragments
+            return out_indent + self._format_leaf_output(out_value)
 
-        return out_text
+        # 0.0 and -0.0 compare equal but format differently, so the sign is part of the key:
+        key = ('leaf', type(out_value), math.copysign(1, out_value), out_value)
+        return out_indent + self._get_fragment(key, self._format_leaf_output, out_value)
+
+    @staticmethod
+    def _format_leaf_output(out_value):
+        if out_value is None:
+            return 'no_bid\n'
+        return '{value:.4f}\n'.format(value=out_value)
 
-    def _get_name_line(self, node):
+    def _get_name_line(self, node, out_indent):
         try:
-            out_indent = self.node[node]['indent']
             out_name = self.node[node]['leaf_name']
             name_line = '{indent}leaf_name: "{name}"\n'.format(indent=out_indent, name=out_name)
         except KeyError:
@@ -584,8 +729,7 @@ class BonsaiTree(nx.DiGraph):
 
         return name_line
 
-    def _get_value_line(self, node):
-        out_indent = self.node[node]['indent']
+    def _get_value_line(self, node, out_indent):
         out_value = self._get_smart_leaf_output_value(node)
         value_line = '{indent}{value}\n'.format(indent=out_indent, value=out_value)
 
@@ -630,37 +774,50 @@ class BonsaiTree(nx.DiGraph):
             value = '_'
         return value
 
-    def _get_conditional_text(self, parent, child):
-        pre_out = self._get_pre_out_statement(parent, child)
-        out = self._get_out_statement(parent, child)
+    def _get_fragment(self, key, format_, *args):
+        """
+        :return: Text `format_(*args)`, formatted once per `key` and interned, so that text
+            repeated all over a tree, e.g. `country in ("GB","DE")`, is built and stored once.
+        """
+        try:
+            hash(key)
+        except TypeError:  # unhashable value
+            return format_(*args)
+
+        try:
+            return self._fragments[key]
+        except KeyError:
+            fragment = format_(*args)
+            self._fragments[key] = fragment = intern(fragment) if type(fragment) is str else fragment
+            return fragment
+
+    def _get_conditional_text(self, parent, child, conditional, indent, switch_header):
+        pre_out = self._get_pre_out_statement(parent, child, conditional, switch_header)
+        out = self._get_out_statement(parent, child, conditional, indent, switch_header)
 
         return pre_out + out
 
-    def _get_pre_out_statement(self, parent, child):
+    def _get_pre_out_statement(self, parent, child, conditional, switch_header):
         type_ = self.edge[parent][child].get('type')
-        conditional = self.node[child]['condition']
 
         pre_out = ''
 
-        if type_ == 'range' and conditional == 'if' and len(set(self.node[parent]['split'].values())) == 1:
-            pre_out = self.node[parent]['switch_header'] + '\n'
+        if type_ == 'range' and conditional == 'if' and switch_header:
+            pre_out = switch_header + '\n'
 
         return pre_out
 
-    def _get_out_statement(self, parent, child):
-        indent = self.node[parent]['indent']
+    def _get_out_statement(self, parent, child, conditional, indent, switch_header):
         value = self.edge[parent][child].get('value')
         type_ = self.edge[parent][child].get('type')
-        conditional = self.node[child]['condition']
         feature = self._get_feature(parent, child, state_node=child)
-        switch_header = self.node[parent].get('switch_header')
         join_statement = self.edge[parent][child].get('join_statement', 'every')
         is_negated = self._get_is_negated(parent, child, feature)
 
         if switch_header and type_ == 'range':
             out = self._get_switch_header_range_statement(indent, value)
         else:
-            out = '{indent}{conditional}'
+            out = indent + conditional
             if type_ is not None and all(isinstance(x, (list, tuple)) for x in (feature, type_)):
                 out += ' ' + join_statement + ' ' + ', '.join(
                     self._get_if_conditional(v, t, f, i, join_statement=join_statement) for v, t, f, i
@@ -679,8 +836,6 @@ class BonsaiTree(nx.DiGraph):
                 )
             out += ':\n'
 
-            out = out.format(indent=indent, conditional=conditional)
-
         return out
 
     def _get_feature(self, parent, child, state_node):
@@ -719,28 +874,30 @@ class BonsaiTree(nx.DiGraph):
         return [feature.index(f) for f in feature if '.' in f and f.split('.')[0] in feature]
 
     def _get_formatted_compound_feature(self, feature, state_node):
+        return self._format_compound_feature(feature, self.node[state_node]['state'])
+
+    def _format_compound_feature(self, feature, state):
         object_, attribute = feature.split('.')
         try:
             attribute, value = attribute.split('__')
         except ValueError:
             try:
-                value = self.node[state_node]['state'][object_]
+                value = state[object_]
             except KeyError:
                 value = self.__getattribute__(object_)
 
-        feature = '{feature}[{value}].{attribute}'.format(
-            feature=object_,
-            value=value,
-            attribute=attribute
+        return self._get_fragment(
+            ('feature', object_, attribute, _get_typed_key(value)), '{}[{}].{}'.format, object_, value, attribute
         )
 
-        return feature
-
-    @staticmethod
-    def _get_switch_header_range_statement(indent, value):
+    def _get_switch_header_range_statement(self, indent, value):
         if value is None:
             return ''
 
+        return indent + self._get_fragment(('case', _get_typed_key(value)), self._format_case_statement, value)
+
+    @staticmethod
+    def _format_case_statement(value):
         left_bound, right_bound = value
         try:
             left_bound = round(left_bound, 4)
@@ -760,8 +917,7 @@ class BonsaiTree(nx.DiGraph):
                 )
             )
 
-        out = '{indent}case ({left_bound} .. {right_bound}):\n'.format(
-            indent=indent,
+        out = 'case ({left_bound} .. {right_bound}):\n'.format(
             left_bound=left_bound,
             right_bound=right_bound
         )
@@ -769,6 +925,12 @@ class BonsaiTree(nx.DiGraph):
         return out
 
     def _get_if_conditional(self, value, type_, feature, is_negated, join_statement=None):
+        return self._get_fragment(
+            ('if', feature, type_, _get_typed_key(value), is_negated, join_statement),
+            self._format_if_conditional, value, type_, feature, is_negated, join_statement
+        )
+
+    def _format_if_conditional(self, value, type_, feature, is_negated, join_statement=None):
 
         if type_ not in {'range', 'membership', 'assignment'}:
             raise ValueError(
@@ -882,9 +1044,8 @@ class BonsaiTree(nx.DiGraph):
         join = '' if join_statement else 'every '
         return join
 
-    def _get_default_conditional_text(self, parent, child):
+    def _get_default_conditional_text(self, parent, child, indent):
         type_ = self._get_sibling_type(parent, child)
-        indent = self.node[parent]['indent']
 
         conditional = 'default' if type_ == 'range' and len(set(self.node[parent]['split'].values())) == 1 else 'else'
 
@@ -904,24 +1065,52 @@ class BonsaiTree(nx.DiGraph):
         return sibling_types[0]
 
     def _tree_to_bonsai(self):
+        """
+        Renders the tree in a single iterative depth-first pass.
+
+        The indentation of a node follows from its depth and the number of switch statements
+        enclosing it, its conditional keyword from its rank among its siblings, and switch mode
+        from the split of its parent, so no rendering state is stored on the nodes.
+        """
         root = self._get_root()
-        stack = deque(self._get_sorted_out_edges(root))
+        switch_header = self._get_switch_header(root)
+        stack = self._get_child_frames(root, '\t' if switch_header else '', switch_header)
 
         while stack:
-            parent, child = stack.popleft()
-
-            next_edges = self._get_sorted_out_edges(child)
-            stack.extendleft(next_edges[::-1])  # extendleft reverses order!
+            parent, child, conditional, indent, switch_header = stack.pop()
 
             if not self.node[child].get('is_default_leaf', False):
-                conditional_text = self._get_conditional_text(parent, child)
-            elif self.node[child].get('is_default_leaf', False):
-                conditional_text = self._get_default_conditional_text(parent, child)
+                conditional_text = self._get_conditional_text(parent, child, conditional, indent, switch_header)
+            else:
+                conditional_text = self._get_default_conditional_text(parent, child, indent)
 
-            out_text = self._get_output_text(child)
+            child_indent = indent + '\t'
+            child_switch_header = None
+            if self.succ[child]:
+                child_switch_header = self._get_switch_header(child)
+                if child_switch_header:
+                    child_switch_header = child_indent + child_switch_header
+                    child_indent += '\t'
+
+                stack.extend(self._get_child_frames(child, child_indent, child_switch_header))
+
+            out_text = self._get_output_text(child, child_indent)
 
             yield conditional_text + out_text
 
+    def _get_child_frames(self, parent, indent, switch_header):
+        """
+        :return: List of the stack frames of the children of `parent`, last child first.
+        """
+        children = self._get_sorted_successors(parent)
+        last = len(children) - 1
+        frames = []
+        for rank in range(last, -1, -1):
+            conditional = 'if' if rank == 0 else 'else' if rank == last else 'elif'
+            frames.append((parent, children[rank], conditional, indent, switch_header))
+
+        return frames
+
     @staticmethod
     def _is_numerical(x):
         try:
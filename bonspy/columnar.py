@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (
+    print_function, division, generators,
+    absolute_import, unicode_literals
+)
+
+from collections import OrderedDict
+from numbers import Number
+
+import numpy as np
+
+
+def get_leaf_table(graph, features=None, as_frame=False):
+    """
+    Exports all leaves and default leaves of a bidding tree as a columnar table.
+
+    Leaves appear in depth-first order from the root, so their row positions
+    are stable for as long as the tree is not modified.
+
+    :param graph: NetworkX graph, e.g. a `BonsaiTree` or the output of `GraphBuilder.get_graph`.
+    :param features: (optional) iterable, state features to export. Defaults to all features
+        found in the leaf states, in order of appearance.
+    :param as_frame: (optional) bool, return a pandas DataFrame instead of a dict of NumPy arrays.
+    :return: Table with the columns 'leaf' (node ids), 'is_default_leaf', and one column per feature.
+        Leaves whose state lacks a feature hold None in that column.
+    """
+    leaves = list(_iter_leaves(graph))
+    states = [graph.node[leaf].get('state', {}) for leaf in leaves]
+
+    if features is None:
+        features = _get_features(states)
+
+    table = {
+        'leaf': _to_column(leaves),
+        'is_default_leaf': np.array([bool(graph.node[leaf].get('is_default_leaf')) for leaf in leaves], dtype=bool)
+    }
+    for feature in features:
+        table[feature] = _to_column([state.get(feature) for state in states])
+
+    if as_frame:
+        import pandas as pd
+        return pd.DataFrame(table, columns=['leaf', 'is_default_leaf'] + list(features))
+    else:
+        return table
+
+
+def set_leaf_values(graph, leaves, values, key='output'):
+    """
+    Writes one value per leaf onto the leaves in a single call.
+
+    :param graph: NetworkX graph the leaves belong to.
+    :param leaves: iterable, leaf node ids, e.g. the 'leaf' column of `get_leaf_table`.
+    :param values: iterable or NumPy array, values in the same order as `leaves`.
+        NaN is written as None, i.e. `no_bid` for outputs.
+    :param key: (optional) str, node attribute the values are written to.
+    :return: The updated graph.
+    """
+    leaves = _to_list(leaves)
+    values = _to_list(values)
+
+    if len(leaves) != len(values):
+        raise ValueError('Got {} values for {} leaves.'.format(len(values), len(leaves)))
+
+    node = graph.node
+    for leaf, value in zip(leaves, values):
+        node[leaf][key] = None if value != value else value  # NaN -> None
+
+    return graph
+
+
+def aggregate_subtrees(graph, sums=(), mins=(), maxs=(), leaves_only=True, store=True, prefix='subtree_'):
+    """
+    Aggregates node attributes over every subtree of a bidding tree in a single bottom-up pass.
+
+    Nodes are laid out in breadth-first order, and each level is added onto its parents' level
+    with NumPy, from the deepest level up. The pass takes O(nodes) and does not recurse.
+
+    :param graph: NetworkX graph, e.g. a `BonsaiTree` or the output of `GraphBuilder.get_graph`.
+    :param sums: (optional) iterable, numerical node attributes to sum, e.g. ('impressions', 'clicks').
+        Nodes without the attribute, or where it is None or NaN, count as 0.
+    :param mins: (optional) iterable, numerical node attributes to take the minimum of, e.g. ('output',).
+        Nodes without the attribute, or where it is None (e.g. `no_bid` leaves) or NaN, are skipped.
+    :param maxs: (optional) iterable, numerical node attributes to take the maximum of, skipped alike.
+    :param leaves_only: (optional) bool, aggregate the attributes of the leaves in each subtree only
+        (default), or of all nodes in each subtree, including its root.
+    :param store: (optional) bool, also store the aggregates as node attributes named `prefix` + column name.
+    :param prefix: (optional) str, prefix of the stored node attributes.
+    :return: dict of NumPy arrays in breadth-first order: 'node' (node ids), 'leaf_count', and
+        'sum_<attribute>', 'min_<attribute>', and 'max_<attribute>' per aggregated attribute.
+        Minima and maxima of subtrees without any value are NaN (None when stored).
+    """
+    nodes, parents, level_starts = _get_levels(graph)
+    is_leaf = np.array([not graph.succ[n] for n in nodes], dtype=bool)
+    is_counted = is_leaf if leaves_only else np.ones(len(nodes), dtype=bool)
+
+    table = {'node': _to_column(nodes), 'leaf_count': _aggregate(is_leaf.astype(np.int64), parents, level_starts)}
+
+    for attribute in sums:
+        values = _get_values(graph, nodes, attribute, default=0)
+        values = np.where(is_counted & ~np.isnan(values), values, 0)
+        table['sum_' + attribute] = _aggregate(values, parents, level_starts)
+
+    for name, operation, attributes, neutral in (('min', np.minimum, mins, np.inf), ('max', np.maximum, maxs, -np.inf)):
+        for attribute in attributes:
+            values = _get_values(graph, nodes, attribute, default=None).astype(float)
+            has_value = is_counted & ~np.isnan(values)
+            aggregate = _aggregate(np.where(has_value, values, neutral), parents, level_starts, operation=operation)
+            # counted separately, as subtrees whose values are all +-inf aggregate to `neutral` as well:
+            value_count = _aggregate(has_value.astype(np.int64), parents, level_starts)
+            aggregate[value_count == 0] = np.nan
+            table[name + '_' + attribute] = aggregate
+
+    if store:
+        for column, aggregate in table.items():
+            if column == 'node':
+                continue
+            for node, value in zip(nodes, aggregate.tolist()):
+                graph.node[node][prefix + column] = None if value != value else value  # NaN -> None
+
+    return table
+
+
+def _get_values(graph, nodes, attribute, default):
+    """
+    :return: Array of the attribute of each node, with None, e.g. the output of `no_bid` leaves, as NaN.
+    """
+    values = [graph.node[n].get(attribute, default) for n in nodes]
+    return np.array([np.nan if value is None else value for value in values])
+
+
+def _get_levels(graph):
+    """
+    :return: Tuple of the node ids in breadth-first order, the position of each node's parent
+        in that order (-1 for the root), and the positions where each level starts.
+    """
+    if len(graph) == 0:
+        return [], np.empty(0, dtype=np.int64), [0]
+
+    nodes = [_get_root(graph)]
+    parents = [-1]
+    level_starts = [0]
+
+    start = 0
+    while start < len(nodes):
+        end = len(nodes)
+        for position in range(start, end):
+            children = graph.succ[nodes[position]]
+            nodes.extend(children)
+            parents.extend([position] * len(children))
+        level_starts.append(end)
+        start = end
+
+    return nodes, np.array(parents, dtype=np.int64), level_starts
+
+
+def _aggregate(values, parents, level_starts, operation=np.add):
+    aggregate = values.copy()
+
+    for start, end in reversed(list(zip(level_starts[1:-1], level_starts[2:]))):
+        operation.at(aggregate, parents[start:end], aggregate[start:end])
+
+    return aggregate
+
+
+def _get_root(graph):
+    return next(n for n in graph.nodes_iter() if not graph.pred[n])
+
+
+def _iter_leaves(graph):
+    if len(graph) == 0:
+        return
+
+    stack = [_get_root(graph)]
+    while stack:
+        node = stack.pop()
+        data = graph.node[node]
+        if data.get('is_leaf') or data.get('is_default_leaf'):
+            yield node
+        stack.extend(reversed(list(graph.succ[node])))
+
+
+def _get_features(states):
+    features = OrderedDict()
+    for state in states:
+        for feature in state:
+            features[feature] = None
+    return list(features)
+
+
+def _to_column(values):
+    if all(isinstance(v, Number) and not isinstance(v, bool) for v in values) and values:
+        return np.array(values)
+
+    column = np.empty(len(values), dtype=object)
+    for index, value in enumerate(values):
+        column[index] = value
+    return column
+
+
+def _to_list(values):
+    try:
+        return values.tolist()  # NumPy arrays and pandas Series, as native Python values
+    except AttributeError:
+        return list(values)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (
+    print_function, division, generators,
+    absolute_import, unicode_literals
+)
+
+import networkx as nx
+import numpy as np
+
+from bonspy.state import PathState
+
+_TREE_LEAF = -1  # `children_left` / `children_right` of leaves in sklearn's tree arrays
+
+
+def get_node_values(tree, class_index=1):
+    """
+    :param tree: sklearn `tree_` attribute, or an object with the same arrays.
+    :param class_index: (optional) int, index of the class whose probability classifiers predict.
+    :return: Array of the predictions of all nodes of the tree, i.e. the probability
+        of class `class_index` for classifiers and the predicted value for regressors.
+    """
+    value = np.asarray(tree.value, dtype=float)[:, 0, :]
+    if value.shape[1] > 1:  # classifier
+        with np.errstate(invalid='ignore'):
+            return value[:, class_index] / value.sum(axis=1)
+    else:
+        return value[:, 0]
+
+
+class DecisionTreeConverter:
+    """
+    Converter that translates a fitted sklearn decision tree to a NetworkX graph
+    that can be output to Bonsai with the `bonspy.BonsaiTree` converter.
+
+    Columns named 'feature=value', as produced by `DictVectorizer` for categorical
+    features, become assignment splits: samples with the value take the right branch,
+    all others, including those lacking the feature, the default branch. Other columns
+    are treated as integer-valued range features: the threshold t splits them into
+    the ranges (.., floor(t)) and (floor(t) + 1, ..), and a default leaf bidding the
+    split node's own prediction catches requests lacking the feature.
+
+    The node arrays of the tree are processed with NumPy, so that only the
+    construction of the graph itself loops over the nodes.
+
+    Attributes:
+        tree: Fitted `DecisionTreeClassifier` or `DecisionTreeRegressor`, or its `tree_` attribute
+            (http://scikit-learn.org/stable/modules/generated/sklearn.tree.DecisionTreeClassifier.html)
+        feature_names (list): Column names by column index, e.g. the `feature_names_` attribute
+            of your trained `DictVectorizer`.
+        types (dict): Optional. Type of the assignment features: 'assignment' (default) or membership.
+        base_bid (float): Constant value that the output of the tree, i.e. the probability of
+            class `class_index` for classifiers or the predicted value for regressors,
+            is multiplied with to produce the output (bid).
+        class_index (int): Optional. Index of the class whose probability is bid on. Defaults to 1.
+    """
+
+    def __init__(self, tree, feature_names, types=None, base_bid=1., class_index=1):
+        self.tree = getattr(tree, 'tree_', tree)
+        self.feature_names = list(feature_names)
+        self.types = types or {}
+        self.base_bid = base_bid
+        self.class_index = class_index
+
+        self.graph = self._create_graph()
+
+    @classmethod
+    def from_forest(cls, forest, feature_names, **kwargs):
+        """
+        :param forest: Fitted sklearn forest, e.g. a `RandomForestClassifier`, or an iterable of trees.
+        :return: List with one converter per tree of the forest.
+        """
+        estimators = getattr(forest, 'estimators_', forest)
+        return [cls(tree, feature_names, **kwargs) for tree in np.ravel(estimators)]
+
+    def get_outputs(self):
+        """
+        :return: Array of the outputs (bids) of all nodes of the tree, indexed by sklearn node id.
+        """
+        return self.base_bid * get_node_values(self.tree, class_index=self.class_index)
+
+    def _get_columns(self, columns):
+        """
+        :return: Tuple of the split feature, split value (None for range features),
+            and split type of each column, parsed once per column.
+        """
+        features, values, types = [], [], []
+        for column in columns:
+            feature, is_assignment, value = self.feature_names[column].partition('=')
+            features.append(feature)
+            values.append(value if is_assignment else None)
+            types.append(self.types.get(feature, 'assignment') if is_assignment else 'range')
+
+        return features, values, types
+
+    def _get_node_arrays(self):
+        tree = self.tree
+        left = np.asarray(tree.children_left)
+        right = np.asarray(tree.children_right)
+        n_nodes = len(left)
+
+        is_split = left != _TREE_LEAF
+        split_nodes = np.flatnonzero(is_split)
+
+        parents = np.full(n_nodes, -1)
+        parents[left[split_nodes]] = split_nodes
+        parents[right[split_nodes]] = split_nodes
+        is_left = np.zeros(n_nodes, dtype=bool)
+        is_left[left[split_nodes]] = True
+
+        # columns are parsed once each, and the results gathered for all split nodes at once:
+        columns, column_positions = np.unique(np.asarray(tree.feature)[split_nodes], return_inverse=True)
+        features, values, types = (np.array(x, dtype=object)[column_positions] for x in self._get_columns(columns))
+
+        split_features = np.full(n_nodes, None, dtype=object)
+        split_values = np.full(n_nodes, None, dtype=object)
+        split_types = np.full(n_nodes, None, dtype=object)
+        split_features[split_nodes] = features
+        split_values[split_nodes] = values
+        split_types[split_nodes] = types
+
+        thresholds = np.zeros(n_nodes, dtype=np.int64)
+        thresholds[split_nodes] = np.floor(np.asarray(tree.threshold)[split_nodes])
+
+        # range splits get an additional default leaf, numbered after the nodes of the tree:
+        is_range_split = split_types == 'range'
+        default_leaves = np.full(n_nodes, -1)
+        default_leaves[is_range_split] = n_nodes + np.arange(np.count_nonzero(is_range_split))
+
+        return (
+            parents.tolist(), is_left.tolist(), is_split.tolist(), split_features.tolist(), split_values.tolist(),
+            split_types.tolist(), thresholds.tolist(), default_leaves.tolist(), self.get_outputs().tolist()
+        )
+
+    def _create_graph(self):
+        g = nx.DiGraph()
+        (parents, is_left, is_split, split_features, split_values,
+         split_types, thresholds, default_leaves, outputs) = self._get_node_arrays()
+
+        states = [PathState()]
+        g.add_node(0, attr_dict=self._get_node_data(states[0], is_split[0], split_features[0], outputs[0]))
+
+        # sklearn numbers children after their parents, so parents are always added first:
+        for node in range(1, len(parents)):
+            parent = parents[node]
+            feature = split_features[parent]
+            type_ = split_types[parent]
+            state = states[parent]
+
+            if type_ == 'range':
+                value = self._get_range(state.get(feature), thresholds[parent], is_left[node])
+            elif not is_left[node]:
+                value = split_values[parent]
+            else:
+                value = None
+
+            if value is None:  # default branch of an assignment split
+                data = self._get_node_data(state, is_split[node], split_features[node], outputs[node], is_default=True)
+                edge_data = {}
+            else:
+                state = state.child(feature, value)  # the feature split on last goes last
+                data = self._get_node_data(state, is_split[node], split_features[node], outputs[node])
+                edge_data = {'value': value, 'type': type_}
+
+            self._add_child(g, parent, node, data, edge_data)
+            states.append(state)
+
+        for node, default_leaf in enumerate(default_leaves):
+            if default_leaf != -1:
+                data = {'state': states[node], 'is_default_leaf': True, 'output': outputs[node]}
+                self._add_child(g, node, default_leaf, data, {})
+
+        return g
+
+    @staticmethod
+    def _get_range(bounds, threshold, is_left):
+        lower, upper = bounds or (None, None)
+        if is_left:
+            return lower, threshold
+        else:
+            return threshold + 1, upper
+
+    @staticmethod
+    def _get_node_data(state, is_split, split, output, is_default=False):
+        data = {'state': state}
+        if is_split:
+            data['split'] = split
+            if is_default:
+                data['is_default_node'] = True
+        else:
+            data['is_default_leaf' if is_default else 'is_leaf'] = True
+            data['output'] = output
+        return data
+
+    @staticmethod
+    def _add_child(g, parent, child, data, edge_data):
+        g.node[child] = data
+        g.succ[child] = {}
+        g.pred[child] = {parent: edge_data}
+        g.succ[parent][child] = edge_data
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (
+    print_function, division, generators,
+    absolute_import, unicode_literals
+)
+
+import numpy as np
+
+from bonspy.decision_tree import DecisionTreeConverter, get_node_values
+
+_TREE_LEAF = -1
+_TREE_UNDEFINED = -2
+
+_LINKS = {
+    'identity': lambda raw: raw,
+    'logistic': lambda raw: 1. / (1. + np.exp(-raw))
+}
+
+
+class EnsembleCompiler:
+    """
+    Compiler that merges an additive ensemble of decision trees, e.g. a fitted gradient
+    boosting model, into a single tree that can be output to Bonsai with the `bonspy.BonsaiTree`
+    converter.
+
+    The ensemble predicts `link(intercept + sum(weight * tree(x)))`. Trees are grafted onto
+    every leaf of the merged tree one at a time, the trees explaining the most variance first,
+    as long as the merged tree stays within `max_nodes`. Splits that the path to a leaf
+    already decides are skipped. The trees that do not fit contribute their expected value
+    over the leaves they can reach under the path's conditions, weighted by the training
+    samples of these leaves.
+
+    Attributes:
+        trees (list): Fitted sklearn regression trees, or their `tree_` attributes.
+        feature_names (list): Column names by column index, e.g. the `feature_names_` attribute
+            of your trained `DictVectorizer`, see `bonspy.DecisionTreeConverter`.
+        weights (list): Weight of each tree in the ensemble, e.g. the learning rate.
+        intercept (float): Constant raw prediction the tree predictions are added to.
+        link (str): 'logistic' to predict probabilities from log odds, or 'identity'.
+        max_nodes (int): Maximum number of nodes of the graph of the merged tree.
+        base_bid (float): Constant value that the prediction of the merged tree is
+            multiplied with to produce the output (bid).
+        types (dict): Optional. Type of the assignment features, see `bonspy.DecisionTreeConverter`.
+        tree_ (CompiledTree): Arrays of the merged tree in the format of sklearn's `tree_` attribute.
+        merged (list): Indices of the trees merged exactly, in the order they were merged.
+        graph (networkx.DiGraph): The merged tree as input to `bonspy.BonsaiTree`.
+    """
+
+    def __init__(self, trees, feature_names, weights=1., intercept=0., link='logistic', max_nodes=10000,
+                 base_bid=1., types=None, class_index=1):
+        if link not in _LINKS:
+            raise ValueError('Link must be one of {}.'.format(sorted(_LINKS)))
+
+        self.trees = [getattr(tree, 'tree_', tree) for tree in np.ravel(trees)]
+        self.feature_names = list(feature_names)
+        self.weights = np.broadcast_to(np.asarray(weights, dtype=float), (len(self.trees),)).tolist()
+        self.intercept = intercept
+        self.link = link
+        self.max_nodes = max_nodes
+        self.base_bid = base_bid
+        self.types = types or {}
+
+        self._values = [get_node_values(tree, class_index=class_index).tolist() for tree in self.trees]
+        self._samples = [self._get_node_samples(tree) for tree in self.trees]
+        self._groups = [name.partition('=')[0] if '=' in name else None for name in self.feature_names]
+        self._split_columns = [self._get_split_columns(tree) for tree in self.trees]
+
+        self.tree_, self.merged = self._compile()
+        self.graph = DecisionTreeConverter(self.tree_, self.feature_names, types=self.types, base_bid=base_bid).graph
+
+    @classmethod
+    def from_gradient_boosting(cls, model, feature_names, X, **kwargs):
+        """
+        :param model: Fitted `GradientBoostingClassifier` (binary) or `GradientBoostingRegressor`.
+        :param feature_names: list, column names by column index.
+        :param X: Sample of the training data, used to recover the constant initial prediction of `model`.
+        :return: Compiler of the trees of `model`.
+        """
+        trees = [tree.tree_ for tree in np.ravel(model.estimators_)]
+        X = _to_dense(X)
+        raw = sum(model.learning_rate * get_node_values(tree)[_apply(tree, X)] for tree in trees)
+        intercept = float(np.mean(np.ravel(model.decision_function(X)) - raw)) if trees else 0.
+
+        kwargs.setdefault('link', 'logistic' if hasattr(model, 'predict_proba') else 'identity')
+        return cls(trees, feature_names, weights=model.learning_rate, intercept=intercept, **kwargs)
+
+    @classmethod
+    def from_forest(cls, model, feature_names, **kwargs):
+        """
+        :param model: Fitted sklearn forest, e.g. a `RandomForestClassifier`.
+        :param feature_names: list, column names by column index.
+        :return: Compiler of the trees of `model`, whose prediction is the mean of the trees' predictions.
+        """
+        trees = np.ravel(model.estimators_)
+        return cls(trees, feature_names, weights=1. / len(trees), link='identity', **kwargs)
+
+    def predict(self, X):
+        """
+        :param X: Array or SciPy sparse matrix of samples, with one column per feature name.
+        :return: Array of the bids of the merged tree.
+        """
+        tree = self.tree_
+        return self.base_bid * tree.value[:, 0, 0][_apply(tree, _to_dense(X))]
+
+    def predict_ensemble(self, X):
+        """
+        :param X: Array or SciPy sparse matrix of samples, with one column per feature name.
+        :return: Array of the bids of the full ensemble.
+        """
+        X = _to_dense(X)
+        raw = self.intercept + sum(
+            weight * np.asarray(values)[_apply(tree, X)]
+            for tree, values, weight in zip(self.trees, self._values, self.weights)
+        )
+        return self.base_bid * _LINKS[self.link](raw)
+
+    def get_bid_error(self, X):
+        """
+        :param X: Array or SciPy sparse matrix of samples, e.g. a sample of the training data.
+        :return: dict with the mean and the maximum absolute difference between the bids
+            of the merged tree and of the full ensemble on `X`.
+        """
+        errors = np.abs(self.predict(X) - self.predict_ensemble(X))
+        return {'mean': float(errors.mean()), 'max': float(errors.max())}
+
+    def _compile(self):
+        root = _Node(_Region())
+        leaves = [root]
+        n_nodes = 1
+        merged = []
+
+        for index in self._get_merge_order():
+            grafts = [self._graft(index, 0, leaf.region) for leaf in leaves]
+            n_added = sum(n for _, n in grafts)
+            if n_nodes + n_added > self.max_nodes:
+                continue
+
+            for leaf, (subtree, _) in zip(leaves, grafts):
+                leaf.graft(subtree)
+
+            leaves = [node for node in root.iter_nodes() if node.is_leaf]
+            n_nodes += n_added
+            merged.append(index)
+
+        return self._get_compiled_tree(root), merged
+
+    def _get_merge_order(self):
+        importances = []
+        for tree, values, samples, weight in zip(self.trees, self._values, self._samples, self.weights):
+            values = np.asarray(values)
+            samples = np.asarray(samples)
+            leaves = np.flatnonzero(np.asarray(tree.children_left) == _TREE_LEAF)
+            variance = np.sum(samples[leaves] / samples[0] * (values[leaves] - values[0]) ** 2)
+            importances.append(weight ** 2 * variance)
+
+        return sorted(range(len(self.trees)), key=lambda index: -importances[index])
+
+    def _graft(self, index, node, region):
+        """
+        :return: Tuple of the subtree of tree `index` from `node` on, restricted to `region`,
+            and the number of nodes its splits add to the graph.
+        """
+        tree = self.trees[index]
+        left = tree.children_left[node]
+        if left == _TREE_LEAF:
+            return _Node(region), 0
+
+        column = int(tree.feature[node])
+        threshold = float(tree.threshold[node])
+        group = self._groups[column]
+        direction = region.get_direction(column, threshold, group)
+
+        if direction < 0:
+            return self._graft(index, left, region)
+        elif direction > 0:
+            return self._graft(index, tree.children_right[node], region)
+
+        left_region, right_region = region.split(column, threshold, group)
+        left_subtree, n_left = self._graft(index, left, left_region)
+        right_subtree, n_right = self._graft(index, tree.children_right[node], right_region)
+
+        # range splits get a default leaf for requests lacking the feature, see `DecisionTreeConverter`:
+        n_added = 2 + (group is None) + n_left + n_right
+        return _Node(region, column, threshold, left_subtree, right_subtree), n_added
+
+    def _expect(self, index, node, region):
+        """
+        :return: Expected prediction of tree `index` from `node` on over the leaves reachable within `region`.
+        """
+        tree = self.trees[index]
+        left = tree.children_left[node]
+        if left == _TREE_LEAF:
+            return self._values[index][node]
+
+        column = int(tree.feature[node])
+        right = tree.children_right[node]
+        direction = region.get_direction(column, float(tree.threshold[node]), self._groups[column])
+
+        if direction < 0:
+            return self._expect(index, left, region)
+        elif direction > 0:
+            return self._expect(index, right, region)
+
+        samples = self._samples[index]
+        left_samples, right_samples = samples[left], samples[right]
+        return (
+            left_samples * self._expect(index, left, region) + right_samples * self._expect(index, right, region)
+        ) / (left_samples + right_samples)
+
+    def _get_expectation(self, index, node, region):
+        """
+        :return: Tuple of the node of tree `index` at or below `node` where the samples within
+            `region` part ways, and the expected prediction of the tree within `region`.
+        """
+        tree = self.trees[index]
+        while tree.children_left[node] != _TREE_LEAF:
+            column = int(tree.feature[node])
+            direction = region.get_direction(column, float(tree.threshold[node]), self._groups[column])
+            if direction < 0:
+                node = tree.children_left[node]
+            elif direction > 0:
+                node = tree.children_right[node]
+            else:
+                break
+
+        return node, self._expect(index, node, region)
+
+    def _get_child_expectations(self, expectations, column, region):
+        """
+        :param expectations: List of the results of `_get_expectation` per tree for the parent region.
+        :param column: Column the parent node of the merged tree is split on.
+        :return: List of the results of `_get_expectation` per tree for `region`, the region
+            of a child. Trees whose splits below the node where the parent's samples parted ways
+            do not depend on `column` keep the parent's expectation, the others are evaluated
+            from that node on.
+        """
+        group = self._groups[column]
+        child_expectations = []
+        for index, expectation in enumerate(expectations):
+            columns = self._split_columns[index][expectation[0]]
+            if column in columns or group in columns:
+                expectation = self._get_expectation(index, expectation[0], region)
+            child_expectations.append(expectation)
+
+        return child_expectations
+
+    def _get_split_columns(self, tree):
+        """
+        :return: List with the set of the columns split on in the subtree of each node of `tree`,
+            and of the one-hot features of these columns.
+        """
+        split_columns = [frozenset()] * len(tree.children_left)
+        for node in reversed(range(len(tree.children_left))):  # children are numbered after their parents
+            left = tree.children_left[node]
+            if left != _TREE_LEAF:
+                column = int(tree.feature[node])
+                columns = {column, self._groups[column]} - {None}
+                split_columns[node] = split_columns[left] | split_columns[tree.children_right[node]] | columns
+
+        return split_columns
+
+    def _get_compiled_tree(self, root):
+        nodes = list(root.iter_nodes())  # depth-first, so children are numbered after their parents
+        ids = {id(node): position for position, node in enumerate(nodes)}
+
+        # the expectations of the trees are derived top-down, each from those of the parent region:
+        expectations = [None] * len(nodes)
+        expectations[0] = [self._get_expectation(index, 0, root.region) for index in range(len(self.trees))]
+
+        children_left = np.full(len(nodes), _TREE_LEAF, dtype=np.int64)
+        children_right = np.full(len(nodes), _TREE_LEAF, dtype=np.int64)
+        feature = np.full(len(nodes), _TREE_UNDEFINED, dtype=np.int64)
+        threshold = np.full(len(nodes), float(_TREE_UNDEFINED))
+        raw = np.full(len(nodes), float(self.intercept))
+
+        for position, node in enumerate(nodes):
+            if not node.is_leaf:
+                children_left[position] = ids[id(node.left)]
+                children_right[position] = ids[id(node.right)]
+                feature[position] = node.column
+                threshold[position] = node.threshold
+                for child in (node.left, node.right):
+                    expectations[ids[id(child)]] = self._get_child_expectations(
+                        expectations[position], node.column, child.region
+                    )
+
+            for weight, (_, expectation) in zip(self.weights, expectations[position]):
+                raw[position] += weight * expectation
+            expectations[position] = None
+
+        with np.errstate(over='ignore'):
+            value = _LINKS[self.link](raw)
+
+        return CompiledTree(children_left, children_right, feature, threshold, value[:, np.newaxis, np.newaxis])
+
+    @staticmethod
+    def _get_node_samples(tree):
+        samples = getattr(tree, 'weighted_n_node_samples', getattr(tree, 'n_node_samples', None))
+        if samples is None:  # without sample counts, both children of a split are equally likely
+            samples = np.zeros(len(tree.children_left))
+            depth = np.zeros(len(tree.children_left))
+            for node, (left, right) in enumerate(zip(tree.children_left, tree.children_right)):
+                if left != _TREE_LEAF:
+                    depth[left] = depth[right] = depth[node] + 1
+            samples = 2. ** -depth
+        return np.asarray(samples, dtype=float).tolist()
+
+
+class CompiledTree:
+    """
+    Arrays of a merged tree in the format of the `tree_` attribute of sklearn's decision trees.
+    """
+
+    def __init__(self, children_left, children_right, feature, threshold, value):
+        self.children_left = children_left
+        self.children_right = children_right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.node_count = len(children_left)
+
+
+class _Node:
+
+    def __init__(self, region, column=None, threshold=None, left=None, right=None):
+        self.region = region
+        self.column = column
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+
+    @property
+    def is_leaf(self):
+        return self.column is None
+
+    def graft(self, subtree):
+        self.column = subtree.column
+        self.threshold = subtree.threshold
+        self.left = subtree.left
+        self.right = subtree.right
+
+    def iter_nodes(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            if not node.is_leaf:
+                stack.extend((node.right, node.left))
+
+
+class _Region:
+    """
+    Conditions on the path to a node of the merged tree: the bounds (lower, exclusive;
+    upper, inclusive) of the columns split on, and the one-hot column set for each feature.
+    """
+
+    def __init__(self, bounds=None, assigned=None):
+        self.bounds = bounds or {}
+        self.assigned = assigned or {}
+
+    def get_direction(self, column, threshold, group):
+        """
+        :return: -1 if all samples within the region go left at the split, 1 if all go right, and 0 otherwise.
+        """
+        lower, upper = self.bounds.get(column, (-np.inf, np.inf))
+        if group is not None and self.assigned.get(group, column) != column:
+            upper = min(upper, 0.)  # another column of the same one-hot feature is set
+
+        if upper <= threshold:
+            return -1
+        elif lower >= threshold:
+            return 1
+        else:
+            return 0
+
+    def split(self, column, threshold, group):
+        lower, upper = self.bounds.get(column, (-np.inf, np.inf))
+
+        left_bounds = dict(self.bounds)
+        left_bounds[column] = lower, min(upper, threshold)
+        right_bounds = dict(self.bounds)
+        right_bounds[column] = max(lower, threshold), upper
+
+        right_assigned = self.assigned
+        if group is not None:
+            right_assigned = dict(self.assigned)
+            right_assigned[group] = column
+
+        return _Region(left_bounds, self.assigned), _Region(right_bounds, right_assigned)
+
+
+def _apply(tree, X):
+    """
+    :return: Array of the index of the leaf of `tree` each row of `X` falls into.
+    """
+    left = np.asarray(tree.children_left)
+    right = np.asarray(tree.children_right)
+    feature = np.asarray(tree.feature)
+    threshold = np.asarray(tree.threshold)
+
+    nodes = np.zeros(len(X), dtype=np.int64)
+    rows = np.flatnonzero(left[nodes] != _TREE_LEAF)
+    while len(rows):
+        current = nodes[rows]
+        goes_left = X[rows, feature[current]] <= threshold[current]
+        nodes[rows] = np.where(goes_left, left[current], right[current])
+        rows = rows[left[nodes[rows]] != _TREE_LEAF]
+
+    return nodes
+
+
+def _to_dense(X):
+    return X.toarray() if hasattr(X, 'toarray') else np.asarray(X)
@@ -5,8 +5,11 @@ from __future__ import (
     absolute_import, unicode_literals
 )
 
+from functools import lru_cache
 from itertools import product
 
+import numpy as np
+
 objects = ['advertiser', 'line_item', 'campaign']
 attributes = ['recency', 'day_frequency', 'lifetime_frequency']
 compound_features = objects + ['segment']
@@ -34,6 +37,10 @@ TYPES = {
 
 TYPES.update({'{object}.{attribute}'.format(object=k, attribute=v): int for (k, v) in product(objects, attributes)})
 
+VALIDATOR_CACHE_SIZE = 2 ** 12  # validated values memoized per feature
+
+_validators = {}  # feature -> (table entries the validator was compiled from, validator)
+
 
 def get_validated(feature, value):
     """
@@ -45,66 +52,109 @@ def get_validated(feature, value):
     :param value: Either one feature value or a tuple / list of feature values.
     :return: The return value has the same dimensionality as the input `value`.
     """
+    validate = get_validator(feature)
 
     if isinstance(value, (list, tuple)):
-        orig_type = type(value)
-        value = list(value)
-        for index, a_value in enumerate(value):
-            value[index] = _get_valid_value(feature, a_value)
-        value = orig_type(value)
-        return value
+        return type(value)([validate(a_value) for a_value in value])
     else:
-        return _get_valid_value(feature, value)
+        return validate(value)
 
 
-def _get_valid_value(feature, value):
-    value = _get_ceiling(feature, value)
-    value = _get_floor(feature, value)
-    value = _type_cast(feature, value)
-    value = _apply_operations(feature, value)
+def get_validated_array(feature, values):
+    """
+    Vectorized `get_validated` for a NumPy array of feature values.
 
-    return value
+    Numeric arrays of features that are only clamped and cast to int are validated with array
+    operations, all other arrays value by value.
 
+    :param feature: str, Name of the feature
+    :param values: array-like of single feature values.
+    :return: Array of the validated values, of integer dtype for integer features.
+    """
+    values = np.asarray(values)
+    type_ = TYPES.get(feature)
 
-def _get_ceiling(feature, value):
-    if value is None:
-        return value
+    is_numeric = values.dtype.kind in 'biuf' and type_ in (None, int) and feature not in OPERATIONS
+    if not is_numeric or (values.dtype.kind == 'f' and not np.isfinite(values).all()):
+        return np.asarray(np.frompyfunc(get_validator(feature), 1, 1)(values), dtype=object)
 
-    try:
-        return min(CEILINGS[feature], value)
-    except KeyError:
-        return value
+    if feature in CEILINGS:
+        values = np.minimum(values, CEILINGS[feature])
+    if feature in FLOORS:
+        values = np.maximum(values, FLOORS[feature])
+    if type_ is int:
+        values = np.trunc(values).astype(np.int64)
 
+    return values
 
-def _get_floor(feature, value):
-    if value is None:
-        return value
 
+def get_validator(feature):
+    """
+    :param feature: str, Name of the feature
+    :return: Function that validates a single value of `feature`, compiled from the entries of
+        `feature` in `CEILINGS`, `FLOORS`, `TYPES`, and `OPERATIONS`, and memoizing its results.
+        It is compiled again whenever these entries change.
+    """
+    entries = (CEILINGS.get(feature), FLOORS.get(feature), TYPES.get(feature), tuple(OPERATIONS.get(feature, ())))
     try:
-        return max(FLOORS[feature], value)
+        compiled_entries, validator = _validators[feature]
+        if compiled_entries == entries:
+            return validator
     except KeyError:
-        return value
+        pass
 
+    validator = _compile_validator(*entries)
+    _validators[feature] = entries, validator
+    return validator
 
-def _type_cast(feature, value):
-    try:
-        return TYPES[feature](value)
-    except KeyError:
-        return value
-    except TypeError:
-        # `value` is None
-        return value
-    except OverflowError:
-        # `value` is -inf or inf
-        return value
+
+def clear_validators():
+    """
+    Drops all compiled validators along with their memoized values.
+    """
+    _validators.clear()
+
+
+def _compile_validator(ceiling, floor, type_, operations):
+    if ceiling is None and floor is None and type_ is None and not operations:
+        return _identity
+
+    def validate(value):
+        if value is None:  # passes every step unchanged
+            return value
+        if ceiling is not None:
+            value = min(ceiling, value)
+        if floor is not None:
+            value = max(floor, value)
+        if type_ is not None:
+            try:
+                value = type_(value)
+            except (TypeError, OverflowError):  # `value` is -inf or inf
+                pass
+        return _apply(operations, value)
+
+    # `typed` keeps e.g. 1 and 1.0 apart, which validate to different values for features without a type:
+    memoized = lru_cache(maxsize=VALIDATOR_CACHE_SIZE, typed=True)(validate)
+
+    def validate_memoized(value):
+        try:
+            hash(value)
+        except TypeError:
+            return validate(value)
+        return memoized(value)
+
+    return validate_memoized
+
+
+def _identity(value):
+    return value
 
 
 def _apply_operations(feature, value):
-    try:
-        operations = OPERATIONS[feature]
-    except KeyError:
-        return value
+    return _apply(OPERATIONS.get(feature, ()), value)
+
 
+def _apply(operations, value):
     for operation in operations:
         try:
             value = operation(value)
@@ -1,27 +1,44 @@
 from abc import ABCMeta, abstractmethod
-from collections import OrderedDict, defaultdict
+from collections import defaultdict
 from csv import DictReader
 import gzip
+from functools import lru_cache, partial
 from glob import glob
+from sys import intern
 
 import networkx as nx
 
+from bonspy.profiling import FeatureOrderProfiler
+from bonspy.state import PathState, get_child_state
+
 
 class GraphBuilder:
 
-    def __init__(self, input_, features, lazy_formatters=(), types_dict={}, functions=()):
+    def __init__(self, input_, features, lazy_formatters=(), types_dict={}, functions=(), bidder=None,
+                 sorted_input=False, formatter_cache_size=2 ** 16):
         """
         :param input_: str or list of str, path to gzipped csv input
         :param features: iterable, ordered features to build the tree with
         :param lazy_formatters: tuple of tuples, e.g. (('os', str), (user_day, int)) or dict
         :param types_dict: dict, types to be used for split, defaults to "assignment"
         :param functions: iterable, functions that return node_dict and take node_dict and row as arguments
+        :param bidder: Bidder, optional, computes the outputs of all leaves while the graph is built.
+            The leaves are handed to `bidder.bid_leaves` in bulk: once for the whole graph, or with
+            `sorted_input`, once per subtree of the root as soon as the input moves past it.
+        :param sorted_input: bool, whether the input rows are sorted by `features` (in that order).
+            Sorted input is streamed: every leaf is finalized as soon as the input moves past it.
+        :param formatter_cache_size: int, maximum number of formatted values memoized per feature,
+            None for no limit. See `formatter_cache_info` for the resulting hit rates.
         """
         self.input_ = glob(input_) if isinstance(input_, str) else input_
         self.features = features
         self.types_iterable = self._get_types_iterable(types_dict)
         self.lazy_formatters = self._get_lazy_formatter(lazy_formatters)
+        self.formatter_cache_size = formatter_cache_size
+        self._formatters = {}
         self.functions = functions
+        self.bidder = bidder
+        self.sorted_input = sorted_input
 
     def _get_types_iterable(self, types_dict):
         return tuple(types_dict.get(f, 'assignment') for f in self.features)
@@ -35,18 +52,171 @@ class GraphBuilder:
             lazy_formatters.update(formatters)
             return lazy_formatters
 
+    def formatter_cache_info(self):
+        """
+        :return: dict, feature -> dict with the hits, misses, hit rate, and size of its formatter cache
+        """
+        info = {}
+        for feature, formatter in self._formatters.items():
+            hits, misses, maxsize, currsize = formatter.cache_info()
+            lookups = hits + misses
+            info[feature] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / lookups if lookups else 0.,
+                'maxsize': maxsize,
+                'currsize': currsize
+            }
+        return info
+
+    def profile_features(self, precision=10):
+        """
+        Profiles the input in one pass to predict the tree size for any order of `features`.
+
+        :param precision: int, HyperLogLog precision, see `bonspy.profiling.FeatureOrderProfiler`
+        :return: FeatureOrderProfiler
+        """
+        formatters = {feature: partial(self._format, feature) for feature in self.features}
+        profiler = FeatureOrderProfiler(self.features, precision=precision, formatters=formatters)
+        return profiler.update(self.get_data())
+
+    def optimize_feature_order(self, precision=10, apply=True):
+        """
+        Finds the order of `features` that minimizes the predicted number of nodes.
+
+        :param precision: int, HyperLogLog precision, see `bonspy.profiling.FeatureOrderProfiler`
+        :param apply: bool, whether to build subsequent graphs in the recommended order
+        :return: list of tuples (feature order, predicted number of nodes), smallest trees first.
+            The best order always comes first, the current order is always included.
+        """
+        profiler = self.profile_features(precision=precision)
+        best_order, _ = profiler.best_order()
+        ranking = profiler.rank_orders()
+        orders = [order for order, _ in ranking]
+        for order in (best_order, list(self.features)):
+            if order not in orders:
+                ranking.append((order, profiler.predicted_size(order)))
+        ranking = sorted(ranking, key=lambda x: (x[1], x[0] != best_order))
+
+        if apply:
+            types_dict = dict(zip(self.features, self.types_iterable))
+            self.features = ranking[0][0]
+            self.types_iterable = self._get_types_iterable(types_dict)
+
+        return ranking
+
     def get_data(self):
         for file in self.input_:
             data = DictReader(gzip.open(file, 'rt', encoding='utf-8'))
             yield from data
 
     def get_graph(self, graph=None):
+        if self.sorted_input:
+            return self._get_graph_sorted(graph)
+
         graph, node_index = self._seed_graph(graph)
 
         data = self.get_data()
         for row in data:
             graph, node_index = self._add_branch(graph, row, node_index)
 
+        if self.bidder is not None:
+            graph = self._bid_leaves(graph)
+
+        return graph
+
+    def _bid_leaves(self, graph):
+        leaves = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            children = graph.succ[node]
+            if children:
+                stack.extend(children)
+            else:
+                leaves.append(node)
+
+        return self.bidder.bid_leaves(graph, leaves)
+
+    def _get_graph_sorted(self, graph):
+        if graph:
+            raise ValueError('Sorted input can only be streamed into a new graph.')
+
+        graph, node_index = self._seed_graph(graph)
+        path = [[0, None, None, set()]]  # [node, value of edge to node, default leaf, values of finalized children]
+        leaves = []  # finalized leaves not bid on yet
+
+        data = self.get_data()
+        for row in data:
+            graph, node_index = self._add_sorted_branch(graph, row, node_index, path, leaves)
+
+        graph = self._finalize_path(graph, path, depth=0, leaves=leaves)
+
+        return graph
+
+    def _add_sorted_branch(self, graph, row, node_index, path, leaves):
+        parent = 0
+        graph.node[parent] = self._apply_functions(graph.node[parent], row)
+        diverged = False
+
+        for depth, feature in enumerate(self.features, start=1):
+            value = self._format(feature, row[feature])
+
+            if not diverged and depth < len(path) and path[depth][1] == value:
+                child = path[depth][0]
+            else:
+                if not diverged:
+                    graph = self._finalize_path(graph, path, depth=depth, leaves=leaves)
+                    diverged = True
+
+                if value in path[-1][3]:
+                    raise ValueError('Input is not sorted by features {}.'.format(self.features))
+
+                if path[-1][2] is None:
+                    default_leaf = node_index
+                    state = self._get_state(graph, parent)
+                    graph.add_node(default_leaf, state=state, is_default_leaf=True)
+                    graph.add_edge(parent, default_leaf)
+                    path[-1][2] = default_leaf
+                    node_index += 1
+
+                child = node_index
+                state = self._get_state(graph, parent, new_feature=(feature, value))
+                graph.add_node(child, state=state)
+                graph = self._connect_node_to_parent(graph, parent, child, feature, value)
+                graph = self._update_parent_split(graph, parent, feature)
+                path.append([child, value, None, set()])
+                node_index += 1
+
+            graph.node[child] = self._apply_functions(graph.node[child], row)
+            parent = child
+        else:
+            graph.node[child]['is_leaf'] = True
+
+        return graph, node_index
+
+    def _finalize_path(self, graph, path, depth, leaves):
+        """
+        Finalizes all nodes on the current path below `depth`:
+        No further input rows can reach them, so their leaves are collected in `leaves`.
+        Once a whole subtree of the root is finalized, the collected leaves are bid on in one batch.
+        """
+        while len(path) > depth:
+            node, value, default_leaf, _ = path.pop()
+
+            if self.bidder is not None:
+                if graph.node[node].get('is_leaf'):
+                    leaves.append(node)
+                if default_leaf is not None:
+                    leaves.append(default_leaf)
+
+            if path:
+                path[-1][3].add(value)
+
+        if depth <= 1 and leaves:
+            graph = self.bidder.bid_leaves(graph, leaves)
+            del leaves[:]
+
         return graph
 
     @staticmethod
@@ -54,7 +224,7 @@ class GraphBuilder:
         if not graph:
             graph = nx.DiGraph()
             root = 0
-            graph.add_node(root, state=OrderedDict())
+            graph.add_node(root, state=PathState())
         node_index = 1 + max((n for n in graph.nodes_iter()))
         return graph, node_index
 
@@ -63,8 +233,8 @@ class GraphBuilder:
         graph.node[parent] = self._apply_functions(graph.node[parent], row)
 
         for feature in self.features:
-            feature_value = row[feature]
-            child = self._get_child(graph, parent, feature, feature_value)
+            feature_value = self._format(feature, row[feature])
+            child = self._get_child(graph, parent, feature_value)
             if child is None:
 
                 childless = self._check_if_childless(graph, parent)
@@ -98,17 +268,20 @@ class GraphBuilder:
         except StopIteration:
             return True
 
-    def _get_state(self, graph, parent, new_feature=None):
-        state = graph.node[parent]['state'].copy()
-        new_state = self._add_new_feature(state, new_feature) if new_feature else state
-        return new_state
+    @staticmethod
+    def _get_state(graph, parent, new_feature=None):
+        state = graph.node[parent]['state']
+        if new_feature:
+            return get_child_state(state, *new_feature)
+        else:
+            return state if isinstance(state, PathState) else state.copy()  # PathStates are immutable
 
-    def _get_child(self, graph, parent, feature, feature_value):
+    @staticmethod
+    def _get_child(graph, parent, feature_value):
         edges = graph.edges_iter(parent, data=True)
         children = ((child, data) for _, child, data in edges if data)  # filter out default leaves
-        formatter = self._get_formatter(self.lazy_formatters[feature])
         try:
-            child = next(child for child, data in children if data.get('value') == formatter(feature_value))
+            child = next(child for child, data in children if data.get('value') == feature_value)
         except StopIteration:
             child = None
         return child
@@ -116,8 +289,7 @@ class GraphBuilder:
     def _connect_node_to_parent(self, graph, parent, new_node, feature, feature_value):
         feature_index = self.features.index(feature)
         type_ = self.types_iterable[feature_index]
-        formatter = self._get_formatter(self.lazy_formatters[feature])
-        graph.add_edge(parent, new_node, type=type_, value=formatter(feature_value))
+        graph.add_edge(parent, new_node, type=type_, value=feature_value)
         return graph
 
     @staticmethod
@@ -130,25 +302,51 @@ class GraphBuilder:
             node_dict = function_(node_dict, row)
         return node_dict
 
-    def _add_new_feature(self, state, new_feature):
-        feature, value = new_feature
-        formatter = self._get_formatter(self.lazy_formatters[feature])
-        state[feature] = formatter(value)
-        return state
+    def _format(self, feature, value):
+        try:
+            formatter = self._formatters[feature]
+        except KeyError:
+            formatter = self._get_formatter(self.lazy_formatters[feature], self.formatter_cache_size)
+            self._formatters[feature] = formatter
+        return formatter(value)
 
     @staticmethod
-    def _get_formatter(formatter):
-        return lambda x: formatter(x) if len(x) > 0 else None
+    def _get_formatter(formatter, cache_size):
+        """
+        Memoizes `formatter` so that repeated raw values are parsed only once and map to
+        one shared (and, for strings, interned) object in all edges and states.
+        """
+        @lru_cache(maxsize=cache_size)
+        def format_(x):
+            if len(x) == 0:
+                return None
+            value = formatter(x)
+            return intern(value) if type(value) is str else value
+
+        return format_
 
 
 class Bidder(metaclass=ABCMeta):
 
     def compute_bids(self, graph):
-        leaves = self.get_leaves(graph)
+        return self.bid_leaves(graph, self.get_leaves(graph))
+
+    def bid_leaves(self, graph, leaves):
+        """
+        Bids on a batch of leaves, one leaf at a time. Bidders that score in bulk override this.
+
+        :param graph: NetworkX DiGraph
+        :param leaves: iterable of leaf nodes of `graph`
+        :return: `graph`, with the outputs written onto the leaves
+        """
         for leaf in leaves:
-            output_dict = self.get_bid(graph=graph, leaf=leaf)
-            for key, value in output_dict.items():
-                graph.node[leaf][key] = value
+            self.bid_leaf(graph, leaf)
+        return graph
+
+    def bid_leaf(self, graph, leaf):
+        output_dict = self.get_bid(graph=graph, leaf=leaf)
+        for key, value in output_dict.items():
+            graph.node[leaf][key] = value
         return graph
 
     @abstractmethod
@@ -5,10 +5,18 @@ from __future__ import (
     absolute_import, unicode_literals
 )
 
+from bisect import bisect_left
 from collections import defaultdict
-import math
+from itertools import islice
+import operator
 
 import networkx as nx
+import numpy as np
+
+from bonspy.bonsai import BonsaiTree
+from bonspy.features import get_validated
+from bonspy.state import PathState
+from bonspy.writer import write_bonsai
 
 
 class LogisticConverter:
@@ -20,18 +28,38 @@ class LogisticConverter:
     Attributes:
         features (list): List of feature names.
         vocabulary (dict): `vocabulary_` attribute of your trained `DictVectorizer`
-            (http://scikit-learn.org/stable/modules/generated/sklearn.feature_extraction.DictVectorizer.html)
+            (http://scikit-learn.org/stable/modules/generated/sklearn.feature_extraction.DictVectorizer.html),
+            or its `feature_names_` attribute, i.e. the sequence of 'feature=value' keys by index.
+            Only the keys of `features` are read, and a sorted sequence is searched instead of scanned.
         weights (list): `coef_` attribute of your trained `SGDClassifier(loss='log', ...)`
-            (http://scikit-learn.org/stable/modules/generated/sklearn.linear_model.SGDClassifier.html)
+            (http://scikit-learn.org/stable/modules/generated/sklearn.linear_model.SGDClassifier.html),
+            as list, NumPy array, or SciPy sparse matrix.
         intercept (float): `intercept_` attribute of your trained `SGDClassifier(loss='log', ...)`
         types (dict): Variable assignment type definitions: 'assignment', 'range', or membership.
         base_bid (float): Constant value that the output of the trained classifier
             is multiplied with to produce the output (bid).
         buckets (dict): Optional. Map for range features from bucket ID's to their bounds.
+        build_graph (bool): Optional. Set to False to skip building `graph`, e.g. when the
+            Bonsai text is only streamed with `iter_bonsai`.
+        min_bid (float): Optional. Bid floor. Leaves bidding below it output `no_bid`, and subtrees
+            that cannot reach it are replaced by a single `no_bid` default leaf.
+        tolerance (float): Optional. Pruning tolerance. Subtrees whose bids all lie within `tolerance`
+            of each other are replaced by a single default leaf bidding the middle of their bid range.
+            Not to be confused with the `report_tolerance` of `update_weights`.
+        min_weight (float): Optional. Feature values with an absolute weight below `min_weight`
+            get no branch of their own but fall into the default leaf of their parent.
+        top_k (int): Optional. Only the `top_k` values of each feature with the largest absolute
+            weights get a branch of their own, the others fall into the default leaf. Ties in
+            magnitude go to the value with the smaller vocabulary index.
+        bids (numpy.ndarray): Bids of all leaves and default leaves indexed by node id,
+            computed in one vectorized pass. Internal nodes and `no_bid` leaves hold NaN.
+        max_bid_error (float): Upper bound of the bid error caused by `min_weight` and `top_k`,
+            i.e. of the difference between the bid of any dropped feature value's default leaf
+            and the bids of the subtree the value would have led to.
     """
 
     def __init__(self, features, vocabulary, weights, intercept, types, base_bid,
-                 buckets=None):
+                 buckets=None, build_graph=True, min_bid=None, tolerance=None, min_weight=None, top_k=None):
 
         self.features = features
         self.vocabulary = vocabulary
@@ -40,16 +68,74 @@ class LogisticConverter:
         self.types = types
         self.base_bid = base_bid
         self.buckets = buckets or {}
+        self.min_bid = min_bid
+        self.tolerance = tolerance
+        self.min_weight = min_weight
+        self.top_k = top_k
+
+        self._full_feature_map = self._get_feature_map()
+        self._convert(build_graph)
+
+    def _convert(self, build_graph):
+        self._weights = self._get_used_weights(self._full_feature_map)
+        self.feature_map, self._dropped = self._sparsify(self._full_feature_map)
+        self._levels, self._pruned, self.max_bid_error = self._get_levels()
+        self._level_offsets = np.cumsum([0] + [len(parents) for parents, _ in self._levels]).tolist()
+        self._child_bounds = self._get_child_bounds()
+        self.bids = self._get_bids()
+        self._published_bids = self.bids.copy()
+
+        self.graph = self._create_graph() if build_graph else None
+
+    def update_weights(self, weights, intercept=None, base_bid=None, report_tolerance=0.):
+        """
+        Re-prices the converted classifier for retrained weights of the same vocabulary.
+
+        The tree structure is reused and all bids are recomputed in one vectorized pass.
+        Only leaves whose bid moved by more than `report_tolerance` since it was last written to
+        `graph` are updated there and reported, so that downstream rendering can be incremental.
+        With `min_bid`, `tolerance` (the pruning tolerance of the constructor), `min_weight`, or `top_k`
+        set the structure itself depends on the weights, and the converter is rebuilt instead.
+
+        :param weights: New `coef_`, see `weights`.
+        :param intercept: (optional) New `intercept_`, defaults to the current intercept.
+        :param base_bid: (optional) New base bid, defaults to the current base bid.
+        :param report_tolerance: (optional) float, bid changes up to this size are neither written
+            nor reported. Unlike the pruning `tolerance`, it does not change the tree structure.
+        :return: Array of the ids of the leaves and default leaves whose bid changed,
+            or of all leaves and default leaves if the converter was rebuilt.
+        """
+        self.weights = weights
+        if intercept is not None:
+            self.intercept = intercept
+        if base_bid is not None:
+            self.base_bid = base_bid
+
+        if any(option is not None for option in (self.min_bid, self.tolerance, self.min_weight, self.top_k)):
+            self._convert(build_graph=self.graph is not None)
+            return np.flatnonzero(self._get_leaf_mask())
+
+        self._weights = self._get_used_weights(self.feature_map)
+        self.bids = self._get_bids()
 
-        self.feature_map = self._get_feature_map()
+        published = self._published_bids
+        with np.errstate(invalid='ignore'):
+            changed = np.abs(self.bids - published) > report_tolerance
+        changed &= self._get_leaf_mask()
+        changed = np.flatnonzero(changed)
+        published[changed] = self.bids[changed]
 
-        self.graph = self._create_graph()
+        if self.graph is not None:
+            node = self.graph.node
+            for leaf, bid in zip(changed.tolist(), self.bids[changed].tolist()):
+                node[leaf]['output'] = bid
+
+        return changed
 
     def _get_feature_map(self):
         buckets = self.buckets
         map_ = defaultdict(dict)
-        for key, index in self.vocabulary.items():
-            feature, value = key.split('=')
+        for feature, value, index in self._iter_vocabulary():
             range_ = buckets.get(feature, {}).get(value)
 
             if range_ is None:
@@ -59,142 +145,388 @@ class LogisticConverter:
 
         return map_
 
-    def _create_graph(self):
-        g = self._create_graph_skeleton()
-        g = self._populate_nodes(g)
-        g = self._populate_edges(g)
+    def _iter_vocabulary(self):
+        """
+        :return: Generator of tuples (feature, value, index) of the vocabulary keys of `features`,
+            with the values as `str` whatever the type of the keys, e.g. `numpy.str_`.
+        """
+        vocabulary = self.vocabulary
+        features = set(self.features)
+
+        if hasattr(vocabulary, 'items'):
+            for key, index in vocabulary.items():
+                feature, _, value = key.partition('=')
+                if feature in features:
+                    yield feature, str(value), index
+
+        elif all(map(operator.le, vocabulary, islice(vocabulary, 1, None))):
+            # the keys of each feature form one block of a sorted sequence, found by bisection:
+            for feature in features:
+                start = bisect_left(vocabulary, feature + '=')
+                end = bisect_left(vocabulary, feature + chr(ord('=') + 1))
+                for index in range(start, end):
+                    yield feature, str(vocabulary[index][len(feature) + 1:]), index
+
+        else:
+            for index, key in enumerate(vocabulary):
+                feature, _, value = key.partition('=')
+                if feature in features:
+                    yield feature, str(value), index
+
+    def _get_used_weights(self, feature_map):
+        """
+        :return: dict from the vocabulary indices in `feature_map` to their weights, looked up in one call.
+        """
+        indices = [index for values in feature_map.values() for index in values.values()]
+        if not indices:
+            return {}
+
+        weights = self.weights
+        if hasattr(weights, 'tocsr'):  # SciPy sparse matrix
+            weights = weights.tocsr() if weights.shape[0] == 1 else weights.T.tocsr()
+            used = weights[0, indices].toarray().ravel()
+        else:
+            used = np.asarray(weights, dtype=float).ravel()[indices]
+
+        return dict(zip(indices, used.tolist()))
+
+    def _sparsify(self, feature_map):
+        """
+        :return: Tuple of the map of the features to their retained values, and a dict from the
+            features with dropped values to the smallest and largest weight among these.
+        """
+        if self.min_weight is None and self.top_k is None:
+            return feature_map, {}
+
+        retained_map = defaultdict(dict)
+        dropped = {}
+
+        for feature, values in feature_map.items():
+            magnitudes = {value: abs(self._weights[index]) for value, index in values.items()}
+            retained = list(values)
+            if self.min_weight is not None:
+                retained = [value for value in retained if magnitudes[value] >= self.min_weight]
+            if self.top_k is not None:
+                # ties in magnitude go to the smaller vocabulary index:
+                retained = sorted(retained, key=lambda value: (-magnitudes[value], values[value]))[:self.top_k]
+            retained = set(retained)
+
+            for value, index in values.items():
+                if value in retained:
+                    retained_map[feature][value] = index
+
+            dropped_weights = [self._weights[index] for value, index in values.items() if value not in retained]
+            if dropped_weights:
+                dropped[feature] = min(dropped_weights), max(dropped_weights)
+
+        return retained_map, dropped
+
+    def _get_levels(self):
+        """
+        Lays the tree out level by level with integer node ids.
+
+        Nodes are numbered breadth-first. The children of each non-default node are stored
+        contiguously on the next level: one per value of the next feature, in `feature_map` order,
+        followed by the default leaf.
+
+        With `min_bid` or `tolerance` set, the range of sums reachable below each node is bounded
+        by the smallest and largest weight of every remaining feature. Nodes whose bid range
+        falls below `min_bid` or is narrower than `tolerance` only get their default leaf.
+        The root is only pruned by `min_bid`, in which case the tree does not bid at all.
+        The same bounds, including dropped values, limit the error of dropping feature values.
+
+        :return: Tuple of a list with one tuple of arrays (parents, positions) per level, a
+            tuple of arrays (node ids, lower sum bounds, upper sum bounds) of the default leaves
+            that replace pruned subtrees, and the maximum bid error of dropped feature values.
+            `parents` holds the index of each node's parent on the level above, `positions` the
+            index of each node's value in `feature_map`, where the index one past the last
+            value marks default leaves.
+        """
+        weight_vectors = self._get_weight_vectors()
+        # default leaves end a path, so 0 is always among the reachable additions of a feature:
+        minima = [weights.min() for weights in weight_vectors]
+        maxima = [weights.max() for weights in weight_vectors]
+        lower, upper = self._get_remaining_sum_bounds(minima, maxima)
+
+        dropped = [self._dropped.get(feature, (0., 0.)) for feature in self.features]
+        full_lower, full_upper = self._get_remaining_sum_bounds(
+            [min(minimum, low) for minimum, (low, _) in zip(minima, dropped)],
+            [max(maximum, high) for maximum, (_, high) in zip(maxima, dropped)]
+        )
+
+        levels = [(np.array([-1]), np.array([-1]))]
+        pruned = [], [], []
+        max_bid_error = 0.
+        sums = np.ravel(self.intercept).astype(float)
+        internal = np.array([0])
+        offset = 1
+
+        for depth, weights in enumerate(weight_vectors):
+            n_values = len(weights) - 1
+            low = sums[internal] + lower[depth]
+            high = sums[internal] + upper[depth]
+            # the root keeps its split under `tolerance`, or the tree would render empty:
+            is_pruned = self._is_prunable(low, high, is_root=depth == 0)
+
+            if self.features[depth] in self._dropped:
+                expanded_sums = sums[internal][~is_pruned]
+                if len(expanded_sums):
+                    error = self._get_dropped_bid_error(
+                        expanded_sums, dropped[depth], full_lower[depth + 1], full_upper[depth + 1]
+                    )
+                    max_bid_error = max(max_bid_error, error)
+
+            counts = np.where(is_pruned, 1, n_values + 1)
+            starts = np.cumsum(counts) - counts
+            parents = np.repeat(internal, counts)
+            positions = np.arange(len(parents)) - np.repeat(starts, counts)
+            positions[np.repeat(is_pruned, counts)] = n_values
+            levels.append((parents, positions))
+
+            for pruned_list, array in zip(pruned, (offset + starts[is_pruned], low[is_pruned], high[is_pruned])):
+                pruned_list.append(array)
+
+            sums = sums[parents] + weights[positions]
+            internal = np.flatnonzero(positions != n_values)
+            offset += len(parents)
+
+        pruned = tuple(np.concatenate(arrays) if arrays else np.array([]) for arrays in pruned)
+        return levels, pruned, max_bid_error
 
-        return g
+    @staticmethod
+    def _get_remaining_sum_bounds(minima, maxima):
+        """
+        :return: Tuple of lists with the smallest and largest sum of weights that the features
+            from each depth on can add to a path, plus (0., 0.) past the last feature.
+        """
+        lower = np.cumsum(minima[::-1])[::-1].tolist() + [0.]
+        upper = np.cumsum(maxima[::-1])[::-1].tolist() + [0.]
+        return lower, upper
+
+    def _get_dropped_bid_error(self, sums, dropped_weights, lower, upper):
+        # a dropped value's default leaf bids at the parent's sum, while the subtree
+        # of the value reaches anything within [sum + weight + lower, sum + weight + upper]:
+        low, high = dropped_weights
+        bids = self._get_bid(sums)
+        errors = np.maximum(self._get_bid(sums + high + upper) - bids, bids - self._get_bid(sums + low + lower))
+        return float(errors.max())
+
+    def _is_prunable(self, low, high, is_root=False):
+        is_prunable = np.zeros(len(low), dtype=bool)
+        if self.min_bid is not None:
+            is_prunable |= self._get_bid(high) < self.min_bid
+        if self.tolerance is not None and not is_root:
+            is_prunable |= self._get_bid(high) - self._get_bid(low) <= self.tolerance
+        return is_prunable
+
+    def _get_child_bounds(self):
+        """
+        :return: List with one tuple of lists (starts, ends) per level but the last, holding the range
+            of each node's children on the level below.
+        """
+        bounds = []
+        for (parents, _), (child_parents, _) in zip(self._levels, self._levels[1:]):
+            indices = np.arange(len(parents))
+            starts = np.searchsorted(child_parents, indices, side='left')
+            ends = np.searchsorted(child_parents, indices, side='right')
+            bounds.append((starts.tolist(), ends.tolist()))
+
+        return bounds
+
+    def _get_weight_vectors(self):
+        return [
+            np.array([self._weights[index] for index in self.feature_map[feature].values()] + [0.], dtype=float)
+            for feature in self.features
+        ]
+
+    def _get_sums(self):
+        """
+        :return: List with one array per level holding the sum of the intercept and the weights
+            on the path to each node, computed for a whole level at once.
+        """
+        sums = [np.ravel(self.intercept).astype(float)]
+        for weights, (parents, positions) in zip(self._get_weight_vectors(), self._levels[1:]):
+            sums.append(sums[-1][parents] + weights[positions])
+
+        return sums
+
+    def _get_bids(self):
+        """
+        :return: Array of the bids of all nodes, indexed by node id. Internal nodes hold NaN.
+        """
+        bids = self._get_bid(np.concatenate(self._get_sums()))
+
+        nodes, low, high = self._pruned
+        bids[nodes.astype(int)] = (self._get_bid(low) + self._get_bid(high)) / 2.
+
+        if self.min_bid is not None:
+            with np.errstate(invalid='ignore'):
+                bids[bids < self.min_bid] = np.nan
+
+        bids[~self._get_leaf_mask()] = np.nan
+        return bids
+
+    def _get_leaf_mask(self):
+        """
+        :return: Boolean array indexed by node id, True for leaves and default leaves.
+        """
+        is_leaf = np.ones(self._level_offsets[-1], dtype=bool)
+        for (starts, ends), offset in zip(self._child_bounds, self._level_offsets):
+            is_leaf[offset:offset + len(starts)] = np.array(ends) == np.array(starts)
+        return is_leaf
+
+    def _get_bid(self, sums):
+        with np.errstate(over='ignore'):
+            return self.base_bid / (1. + np.exp(-sums))
 
-    def _create_graph_skeleton(self):
+    def _create_graph(self):
         g = nx.DiGraph()
 
-        features = [tuple()] + self.features
-        queue = [tuple()]
-        g.add_node(tuple(), weight=self.intercept)
-
-        while len(queue) > 0:
-            parent = queue.pop(0)
-            index = len(parent)
-
-            try:
-                next_feature = features[index + 1]
-            except IndexError:
-                continue
-
-            for value, weight_index in self.feature_map[next_feature].items():
-                child = tuple(list(parent) + [value])
-                g.add_edge(parent, child)
-                g.node[child]['weight'] = self.weights[weight_index]
-                queue.append(child)
-
-            # add default leaf / else node:
-            value = None
-            child = tuple(list(parent) + [value])
-            g.add_edge(parent, child)
-            g.node[child]['weight'] = 0.
+        root_state = PathState()
+        root_data = {'state': root_state}
+        if self.features:
+            root_data['split'] = self.features[0]
+        g.add_node(0, attr_dict=root_data)
+
+        states = [root_state]
+        bids = [None if bid != bid else bid for bid in self.bids.tolist()]  # NaN -> None, i.e. no_bid
+
+        for depth, feature in enumerate(self.features, start=1):
+            parents, positions = self._levels[depth]
+            parent_offset = self._level_offsets[depth - 1]
+            offset = self._level_offsets[depth]
+
+            values = list(self.feature_map[feature])
+            type_ = self.types[feature]
+            split = self.features[depth] if depth < len(self.features) else None
+
+            next_states = []
+
+            for node, (parent, position) in enumerate(zip(parents.tolist(), positions.tolist()), start=offset):
+                if position == len(values):  # default leaf / else node
+                    state = states[parent]
+                    data = {'state': state, 'is_default_leaf': True, 'output': bids[node]}
+                    edge_data = {}
+                else:
+                    state = states[parent].child(feature, values[position])
+                    data = {'state': state}
+                    if split is None:
+                        data['is_leaf'] = True
+                        data['output'] = bids[node]
+                    else:
+                        data['split'] = split
+                    edge_data = {'value': values[position], 'type': type_}
+
+                self._add_child(g, parent_offset + parent, node, data, edge_data)
+                next_states.append(state)
+
+            states = next_states
 
         return g
 
-    def _populate_nodes(self, g):
-        g = self._add_state(g)
-        g = self._add_split(g)
-        g = self._sum_weights(g)
-        g = self._add_leaf_output(g)
-        g = self._add_default_leaf_output(g)
-
-        return g
-
-    def _populate_edges(self, g):
-        g = self._add_value(g)
-        g = self._add_type(g)
-
-        return g
-
-    def _add_state(self, g):
-        for node in nx.dfs_preorder_nodes(g, tuple()):
-            if node == tuple():
-                state = {}
-            elif node[-1] is None:
-                parent = g.predecessors(node)[0]
-                state = g.node[parent]['state']
-            else:
-                state = {feat: value for feat, value in zip(self.features, node)}
-
-            g.node[node]['state'] = state
-
-        return g
-
-    def _add_split(self, g):
-        for node in g.nodes():
-            if node != tuple() and node[-1] is None:
-                continue  # skip default leaf
-
-            index = len(node)
-            try:
-                split = self.features[index]
-                g.node[node]['split'] = split
-            except IndexError:
-                continue
-
-        return g
-
-    def _sum_weights(self, g):
-        queue = [tuple()]
-        g.node[tuple()]['sum'] = g.node[tuple()]['weight']
-
-        while len(queue) > 0:
-            parent = queue.pop(0)
-            parent_sum = g.node[parent]['sum']
-
-            children = g.successors(parent)
-            queue += children
-
-            for child in children:
-                g.node[child]['sum'] = parent_sum + g.node[child]['weight']
-
-        return g
-
-    def _add_leaf_output(self, g):
-        for node in g.nodes():
-            if len(g.successors(node)) > 0 or node[-1] is None:
-                continue
-
-            g.node[node]['is_leaf'] = True
-            g.node[node]['output'] = self._sigmoid(g.node[node]['sum']) * self.base_bid
-
-        return g
-
-    def _add_default_leaf_output(self, g):
-        for node in g.nodes():
-            if len(g.successors(node)) > 0 or node[-1] is not None:
-                continue
-
-            g.node[node]['is_default_leaf'] = True
-            g.node[node]['output'] = self._sigmoid(g.node[node]['sum']) * self.base_bid
-
-        return g
-
-    def _add_value(self, g):
-        for parent, child in g.edges():
-            value = child[-1]
-            if value is None:
+    @staticmethod
+    def _add_child(g, parent, child, data, edge_data):
+        # `child` is known to be new, so the adjacency is filled in directly instead
+        # of going through the checks and copies of `add_node` and `add_edge`:
+        g.node[child] = data
+        g.succ[child] = {}
+        g.pred[child] = {parent: edge_data}
+        g.succ[parent][child] = edge_data
+
+    def iter_bonsai(self):
+        """
+        Yields the Bonsai text of the converted classifier, byte-identical to
+        `BonsaiTree(self.graph).bonsai`, without building a graph.
+
+        The tree is walked depth-first straight from the level arrays and `bids`,
+        holding only the current path in memory.
+        """
+        renderer = BonsaiTree()
+        values = [[get_validated(feature, value) for value in self.feature_map[feature]] for feature in self.features]
+        positions = [level_positions.tolist() for _, level_positions in self._levels]
+        bids = self.bids.tolist()
+
+        if not self._is_leaf(0, 0):
+            indent = '\t' if self._is_switch(0) else ''
+            for text in self._iter_bonsai_node(renderer, values, positions, bids, 0, 0, PathState(), indent):
+                yield text
+
+    def write(self, fp, encoding='text'):
+        """
+        Streams the Bonsai text of `iter_bonsai` to a binary file object.
+
+        :param fp: binary file object, e.g. opened with mode 'wb'.
+        :param encoding: (optional) 'text', 'base64', or 'gzip'.
+        """
+        write_bonsai(self.iter_bonsai(), fp, encoding=encoding)
+
+    def _iter_bonsai_node(self, renderer, values, positions, bids, depth, index, state, indent):
+        feature = self.features[depth]
+        is_switch = self._is_switch(depth)
+        child_indent = indent + '\t'
+        child_offset = self._level_offsets[depth + 1]
+        starts, ends = self._child_bounds[depth]
+        start = starts[index]
+
+        if is_switch:
+            yield '{indent}switch {feature}:\n'.format(
+                indent=indent[:-1], feature=self._format_feature(renderer, feature, state)
+            )
+
+        for child in range(start, ends[index]):
+            position = positions[depth + 1][child]
+
+            if position == len(values[depth]):  # default leaf / else node
+                yield '{indent}{conditional}:\n'.format(indent=indent, conditional='default' if is_switch else 'else')
+                yield self._get_leaf_text(child_indent, bids[child_offset + child])
                 continue
 
-            g.edge[parent][child]['value'] = value
-
-        return g
+            value = values[depth][position]
+            child_state = state.child(feature, value)
 
-    def _add_type(self, g):
-        for parent, child in g.edges():
-            if child[-1] is None:
-                continue
-
-            feature = g.node[parent]['split']
-            g.edge[parent][child]['type'] = self.types[feature]
+            if is_switch:
+                yield renderer._get_switch_header_range_statement(indent, value)
+            else:
+                conditional = renderer._get_if_conditional(
+                    value, self.types[feature], self._format_feature(renderer, feature, child_state), False
+                )
+                yield '{indent}{conditional} {statement}:\n'.format(
+                    indent=indent, conditional='if' if child == start else 'elif', statement=conditional
+                )
+
+            if self._is_leaf(depth + 1, child):
+                yield self._get_leaf_text(child_indent, self._get_leaf_bid(bids, depth + 1, child))
+            else:
+                grandchild_indent = child_indent + '\t' if self._is_switch(depth + 1) else child_indent
+                children = self._iter_bonsai_node(
+                    renderer, values, positions, bids, depth + 1, child, child_state, grandchild_indent
+                )
+                for text in children:
+                    yield text
+
+    def _is_leaf(self, depth, index):
+        # nodes whose only child is their default leaf are folded into it by `BonsaiTree`:
+        if depth == len(self._child_bounds):
+            return True
+        starts, ends = self._child_bounds[depth]
+        return ends[index] - starts[index] <= 1
+
+    def _get_leaf_bid(self, bids, depth, index):
+        if depth < len(self._child_bounds):
+            starts, ends = self._child_bounds[depth]
+            if ends[index] > starts[index]:
+                return bids[self._level_offsets[depth + 1] + starts[index]]
+        return bids[self._level_offsets[depth] + index]
+
+    def _is_switch(self, depth):
+        return self.types[self.features[depth]] == 'range'
 
-        return g
+    @staticmethod
+    def _format_feature(renderer, feature, state):
+        return renderer._format_compound_feature(feature, state) if '.' in feature else feature
 
     @staticmethod
-    def _sigmoid(x):
-        return 1. / (1. + math.exp(-x))
+    def _get_leaf_text(indent, bid):
+        if bid != bid:  # NaN
+            return '{indent}no_bid\n'.format(indent=indent)
+        return '{indent}{value:.4f}\n'.format(indent=indent, value=bid)
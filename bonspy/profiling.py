@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (
+    print_function, division, generators,
+    absolute_import, unicode_literals
+)
+
+from hashlib import md5
+from itertools import islice, permutations
+
+import numpy as np
+
+_RANK_BITS = 52  # low hash bits used for the register ranks, exactly representable as float64
+_MAX_CACHED_HASHES = 2 ** 20
+_ALPHA = {16: 0.673, 32: 0.697, 64: 0.709}  # bias correction of small HyperLogLog sketches
+
+
+class FeatureOrderProfiler:
+    """
+    Single-pass profiler that predicts the size of the tree `GraphBuilder` builds
+    for any order of its features.
+
+    The number of distinct value combinations of every subset of the features is
+    estimated with one HyperLogLog sketch per subset. As the nodes on one level of the
+    tree are exactly the distinct combinations of the features split on above it, these
+    estimates give the node count of the tree for every feature order, and the order
+    with the fewest nodes is found by dynamic programming over the feature subsets.
+
+    Attributes:
+        features (list): List of feature names.
+        precision (int): Number of hash bits that index the HyperLogLog registers.
+            The relative error of the estimates is about 1.04 / sqrt(2 ** precision).
+        formatters (dict): Optional. Map from feature names to functions that format
+            raw input values, e.g. `GraphBuilder._format` bound to the feature.
+        chunk_size (int): Optional. Number of input rows hashed at a time.
+        max_features (int): Optional. Largest number of features to profile, as time and
+            memory grow with the number of subsets.
+
+    Memory use is bounded by the registers, 2 ** len(features) * 2 ** precision bytes
+    (64 MiB for 16 features at the default precision), plus the value hashes of about
+    2 * len(features) * chunk_size 8-byte integers. The time per row grows with 2 ** len(features).
+    """
+
+    def __init__(self, features, precision=10, formatters=None, chunk_size=4096, max_features=16):
+        if len(features) > max_features:
+            raise ValueError(
+                'Profiling {} features needs 2 ** {} sketches, '
+                'raise max_features to allow this.'.format(len(features), len(features))
+            )
+        if not 4 <= precision <= 12:
+            raise ValueError('Precision must be between 4 and 12.')
+
+        self.features = list(features)
+        self.precision = precision
+        self.formatters = formatters or {}
+        self.chunk_size = chunk_size
+        self.registers = np.zeros((2 ** len(self.features), 2 ** precision), dtype=np.uint8)
+        self._hashes = [{} for _ in self.features]
+        self._cardinalities = None
+
+    def update(self, rows):
+        """
+        :param rows: iterable of dicts, input rows as produced by `GraphBuilder.get_data`.
+        :return: The updated profiler.
+        """
+        rows = iter(rows)
+        chunk = list(islice(rows, self.chunk_size))
+        while chunk:
+            self._update_chunk(chunk)
+            chunk = list(islice(rows, self.chunk_size))
+
+        self._cardinalities = None
+        return self
+
+    def cardinality(self, features):
+        """
+        :param features: iterable, subset of `features`.
+        :return: float, estimated number of distinct value combinations of `features`.
+        """
+        return self._get_cardinalities()[self._get_mask(features)]
+
+    def predicted_size(self, order):
+        """
+        :param order: iterable, permutation of `features`.
+        :return: float, estimated number of nodes (including default leaves) of the tree built in this order.
+        """
+        cardinalities = self._get_cardinalities()
+        masks = self._get_prefix_masks(order)
+        return 2. + 2. * sum(cardinalities[mask] for mask in masks[1:-1]) + cardinalities[masks[-1]]
+
+    def best_order(self):
+        """
+        :return: Tuple of the feature order with the smallest predicted tree and its predicted size.
+        """
+        cardinalities = self._get_cardinalities()
+        full = len(cardinalities) - 1
+
+        # cost[mask]: smallest sum of cardinalities over the proper prefixes of any order of the features in mask
+        cost = np.zeros(len(cardinalities))
+        last = np.zeros(len(cardinalities), dtype=np.int64)
+        for mask in range(1, full + 1):
+            candidates = [(cost[mask & ~(1 << i)], i) for i in range(len(self.features)) if mask & (1 << i)]
+            cost[mask], last[mask] = min(candidates)
+            if mask != full:
+                cost[mask] += cardinalities[mask]
+
+        order = []
+        mask = full
+        while mask:
+            order.append(self.features[last[mask]])
+            mask &= ~(1 << last[mask])
+        order = order[::-1]
+
+        return order, self.predicted_size(order)
+
+    def rank_orders(self, orders=None, top=None):
+        """
+        :param orders: (optional) iterable of feature orders to compare. Defaults to all orders
+            for up to seven features, and otherwise to the best order, the profiled order, and
+            the orders by increasing and decreasing feature cardinality.
+        :param top: (optional) int, number of orders to return.
+        :return: List of tuples (feature order, predicted number of nodes), smallest trees first.
+        """
+        if orders is None:
+            orders = self._get_candidate_orders()
+
+        ranking = sorted(((list(order), self.predicted_size(order)) for order in orders), key=lambda x: x[1])
+        return ranking[:top]
+
+    def _get_candidate_orders(self):
+        if len(self.features) <= 7:
+            return permutations(self.features)
+
+        by_cardinality = sorted(self.features, key=lambda f: self.cardinality([f]))
+        candidates = [self.best_order()[0], self.features, by_cardinality, by_cardinality[::-1]]
+        unique = {tuple(order): order for order in candidates}
+        return unique.values()
+
+    def _update_chunk(self, chunk):
+        hashes = np.empty((len(self.features), len(chunk)), dtype=np.uint64)
+        for index, feature in enumerate(self.features):
+            hashes[index] = self._hash_values(index, feature, [row[feature] for row in chunk])
+
+        self._add_subsets(hashes, 0, np.zeros(len(chunk), dtype=np.uint64), 0)
+
+    def _add_subsets(self, hashes, mask, subset_hashes, start):
+        """
+        Adds the hashes of all subsets that extend `mask` by features from index `start` on,
+        depth-first, so that only the subset hashes along the current path are held in memory.
+        """
+        for index in range(start, len(hashes)):
+            child_mask = mask | 1 << index
+            child_hashes = subset_hashes ^ hashes[index]
+            self._add(child_mask, _mix(child_hashes))
+            self._add_subsets(hashes, child_mask, child_hashes, index + 1)
+
+    def _hash_values(self, index, feature, values):
+        cache = self._hashes[index]
+        if len(cache) > _MAX_CACHED_HASHES:
+            cache.clear()
+
+        formatter = self.formatters.get(feature)
+        out = np.empty(len(values), dtype=np.uint64)
+        for position, value in enumerate(values):
+            try:
+                out[position] = cache[value]
+            except KeyError:
+                formatted = formatter(value) if formatter else value
+                digest = md5('{}\x1f{!r}'.format(feature, formatted).encode('utf-8')).digest()[:8]
+                cache[value] = out[position] = int.from_bytes(digest, 'little')
+
+        return out
+
+    def _add(self, mask, hashes):
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        rank_bits = (hashes & np.uint64(2 ** _RANK_BITS - 1)).astype(np.float64)
+        rank = (_RANK_BITS + 1 - np.frexp(rank_bits)[1]).astype(np.uint8)  # position of the leading one bit
+        np.maximum.at(self.registers[mask], index, rank)
+
+    def _get_cardinalities(self):
+        if self._cardinalities is None:
+            m = self.registers.shape[1]
+            alpha = _ALPHA.get(m, 0.7213 / (1 + 1.079 / m))
+            raw = alpha * m ** 2 / np.sum(np.exp2(-self.registers.astype(np.float64)), axis=1)
+            zeros = np.sum(self.registers == 0, axis=1)
+            with np.errstate(divide='ignore'):
+                linear = m * np.log(m / np.maximum(zeros, 1))
+            cardinalities = np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+            cardinalities[0] = 1.  # the empty combination, i.e. the root
+            self._cardinalities = cardinalities
+
+        return self._cardinalities
+
+    def _get_mask(self, features):
+        mask = 0
+        for feature in features:
+            mask |= 1 << self.features.index(feature)
+        return mask
+
+    def _get_prefix_masks(self, order):
+        if sorted(order) != sorted(self.features):
+            raise ValueError('Order {} is not a permutation of features {}.'.format(order, self.features))
+
+        masks = [0]
+        for feature in order:
+            masks.append(masks[-1] | 1 << self.features.index(feature))
+        return masks
+
+
+def _mix(hashes):
+    """
+    SplitMix64 finalizer, spreads the XOR-combined value hashes of a feature subset over all bits.
+    """
+    with np.errstate(over='ignore'):
+        hashes = (hashes ^ (hashes >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        hashes = (hashes ^ (hashes >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return hashes ^ (hashes >> np.uint64(31))
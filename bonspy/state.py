@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (
+    print_function, division, generators,
+    absolute_import, unicode_literals
+)
+
+from collections import OrderedDict
+from collections.abc import Mapping
+
+_NO_FEATURE = object()  # feature of the empty root state
+
+
+class PathState(Mapping):
+    """
+    Immutable node state that stores only the (feature, value) pair assigned by its node
+    and a pointer to the state of the parent node.
+
+    Reading a feature walks up the chain of parent states, so that the state of a child is
+    derived in constant time and memory with `child`, and the states of all nodes share
+    the states of their ancestors. A feature assigned again further down shadows its earlier
+    assignment and moves to the end of the iteration order, just as for an `OrderedDict` state
+    from which the feature is popped and set again. The length of a state, which discounts
+    shadowed features, is counted on first use and cached.
+
+    States support read-only dict access, compare equal to mappings with the same items,
+    and are hashable as long as their values are, with the hash computed once and cached.
+
+    Attributes:
+        parent (PathState): State of the parent node, None for the empty root state.
+        feature: Feature assigned by the node.
+        value: Value assigned to `feature` by the node.
+    """
+
+    __slots__ = ('parent', 'feature', 'value', '_length', '_hash')
+
+    def __init__(self, items=()):
+        """
+        :param items: (optional) mapping or iterable of (feature, value) pairs, in path order.
+        """
+        items = list(items.items() if isinstance(items, Mapping) else items)
+
+        if items:
+            parent = PathState()
+            for feature, value in items[:-1]:
+                parent = parent.child(feature, value)
+            self._set(parent, *items[-1])
+        else:
+            self.parent = None
+            self.feature = _NO_FEATURE
+            self.value = None
+            self._length = 0
+            self._hash = None
+
+    def _set(self, parent, feature, value):
+        self.parent = parent
+        self.feature = feature
+        self.value = value
+        self._length = None  # counting shadowed features walks the chain, so is left to `__len__`
+        self._hash = None
+
+    def child(self, feature, value):
+        """
+        :return: PathState of a child node that assigns `value` to `feature`.
+        """
+        state = PathState.__new__(PathState)
+        state._set(self, feature, value)
+        return state
+
+    def rewrite(self, function, memo=None):
+        """
+        :param function: callable that maps a feature and its value to the (feature, value) pair
+            replacing them, or to None to drop them.
+        :param memo: (optional) dict, shared by all calls with the same `function`, so that
+            every state is rewritten once and the rewritten states share their ancestors as well.
+        :return: PathState with the rewritten items, `self` if no item changed.
+        """
+        memo = {} if memo is None else memo
+
+        chain = []
+        state = self
+        while state.parent is not None and id(state) not in memo:
+            chain.append(state)
+            state = state.parent
+        rewritten = memo[id(state)][1] if state.parent is not None else state
+
+        for state in reversed(chain):
+            item = function(state.feature, state.value)
+            if item is None:
+                pass
+            elif rewritten is state.parent and item[0] is state.feature and item[1] is state.value:
+                rewritten = state
+            else:
+                rewritten = rewritten.child(*item)
+            memo[id(state)] = (state, rewritten)  # the original is kept alive so that its id is not reused
+
+        return rewritten
+
+    def to_dict(self):
+        """
+        :return: OrderedDict with the items of the state, e.g. to modify or serialize them.
+        """
+        return OrderedDict(self.items())
+
+    def _iter_reversed_items(self):
+        seen = set()
+        state = self
+        while state.parent is not None:
+            if state.feature not in seen:
+                seen.add(state.feature)
+                yield state.feature, state.value
+            state = state.parent
+
+    def items(self):
+        return list(self._iter_reversed_items())[::-1]
+
+    def keys(self):
+        return [feature for feature, _ in self.items()]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def __getitem__(self, feature):
+        state = self
+        while state.parent is not None:
+            if state.feature == feature:
+                return state.value
+            state = state.parent
+        raise KeyError(feature)
+
+    def __contains__(self, feature):
+        state = self
+        while state.parent is not None:
+            if state.feature == feature:
+                return True
+            state = state.parent
+        return False
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __reversed__(self):
+        return (feature for feature, _ in self._iter_reversed_items())
+
+    def __len__(self):
+        if self._length is None:
+            self._length = sum(1 for _ in self._iter_reversed_items())
+        return self._length
+
+    def __bool__(self):
+        return self.parent is not None
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        elif isinstance(other, PathState):
+            return len(self) == len(other) and self.items() == other.items()
+        else:
+            return Mapping.__eq__(self, other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(tuple(self.items()))
+        return self._hash
+
+    def __repr__(self):
+        return 'PathState({!r})'.format(self.items())
+
+
+def get_child_state(state, feature, value):
+    """
+    :param state: PathState or other mapping, state of the parent node.
+    :return: State of a child node that assigns `value` to `feature`: a derived PathState,
+        or an updated copy of other mappings.
+    """
+    if isinstance(state, PathState):
+        return state.child(feature, value)
+
+    state = state.copy()
+    state[feature] = value
+    return state
+
+
+def rewrite_state(state, function, memo):
+    """
+    Rewrites the items of a PathState, see `PathState.rewrite`, or of another mapping,
+    which is replaced by an OrderedDict if any of its items change.
+
+    :param memo: dict, shared by all calls with the same `function`.
+    """
+    if isinstance(state, PathState):
+        return state.rewrite(function, memo)
+
+    try:
+        return memo[id(state)][1]
+    except KeyError:
+        pass
+
+    items = list(state.items())
+    rewritten_items = [item for item in (function(feature, value) for feature, value in items) if item is not None]
+    is_unchanged = len(items) == len(rewritten_items) and all(
+        new[0] is old[0] and new[1] is old[1] for old, new in zip(items, rewritten_items)
+    )
+
+    rewritten = state if is_unchanged else OrderedDict(rewritten_items)
+    memo[id(state)] = (state, rewritten)
+    return rewritten
@@ -1096,3 +1096,44 @@ def small_unsliced_graph_mixed_split():
     g.add_edge(0, 'default_one')
 
     return g
+
+
+@pytest.fixture
+def logistic_converter_kwargs():
+    features = ['segment', 'segment.age', 'geo', 'user_hour']
+
+    vocabulary = {
+        'segment=12345': 0,
+        'segment=67890': 1,
+        'segment.age=0': 2,
+        'segment.age=1': 3,
+        'geo=UK': 4,
+        'geo=DE': 5,
+        'geo=US': 6,
+        'user_hour=0': 7,
+        'user_hour=1': 8,
+        'domain=www.example.com': 9
+    }
+
+    weights = [.1, .2, .15, .25, .1, .1, .2, .3, -.2, .5]
+
+    buckets = {
+        'segment.age': {
+            '0': (None, 10),
+            '1': (10, None)
+        },
+        'user_hour': {
+            '0': (-1, 12),
+            '1': (13, 30)
+        }
+    }
+
+    types = {
+        'segment': 'assignment',
+        'segment.age': 'range',
+        'geo': 'assignment',
+        'user_hour': 'range'
+    }
+
+    return dict(features=features, vocabulary=vocabulary, weights=weights, intercept=.4,
+                types=types, base_bid=2., buckets=buckets)
@@ -0,0 +1,190 @@
+import asyncio
+import json
+
+import pytest
+
+from bonspy.async_bidder import AsyncBidder, ScoringClient
+from bonspy.graph_builder import GraphBuilder
+
+
+class LocalScoringServer:
+    """Stand-in for the scoring service: scores each state with 1 / (1 + number of features)."""
+
+    def __init__(self):
+        self.batch_sizes = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        states = json.loads((await reader.readline()).decode())
+        self.in_flight += 1
+        self.max_in_flight = max(self.in_flight, self.max_in_flight)
+        self.batch_sizes.append(len(states))
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        scores = [1. / (1 + len(state)) for state in states]
+        writer.write(json.dumps(scores).encode() + b'\n')
+        await writer.drain()
+        writer.close()
+
+
+class TCPScoringClient(ScoringClient):
+
+    def __init__(self, port, failures=0):
+        self.port = port
+        self.failures = failures
+
+    async def score(self, states):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError('Scoring service unavailable.')
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        writer.write(json.dumps(states).encode() + b'\n')
+        scores = json.loads((await reader.readline()).decode())
+        writer.close()
+        return scores
+
+
+class BarrierScoringClient(ScoringClient):
+    """Holds back every request until `n_concurrent` requests are in flight at the same time."""
+
+    def __init__(self, n_concurrent, timeout=5.):
+        self.n_concurrent = n_concurrent
+        self.timeout = timeout
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.batch_sizes = []
+        self.barrier = None
+
+    async def score(self, states):
+        self.batch_sizes.append(len(states))
+        if self.barrier is None:
+            self.barrier = asyncio.Event()
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.in_flight, self.max_in_flight)
+        if self.in_flight == self.n_concurrent:
+            self.barrier.set()
+
+        await asyncio.wait_for(self.barrier.wait(), self.timeout)  # times out unless requests overlap
+        self.in_flight -= 1
+        return [1.] * len(states)
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def _run_against_server(graph, **kwargs):
+    async def run():
+        server = LocalScoringServer()
+        port = await server.start()
+        try:
+            bidder = AsyncBidder(client=TCPScoringClient(port, failures=kwargs.pop('failures', 0)), **kwargs)
+            return await bidder.compute_bids_async(graph), server
+        finally:
+            await server.stop()
+
+    return _run(run())
+
+
+def test_async_bidder(data_features_and_file):
+    features, path = data_features_and_file
+    graph = GraphBuilder(path, features).get_graph()
+    leaves = list(AsyncBidder.get_leaves(graph))
+
+    graph, server = _run_against_server(graph, base_bid=2., batch_size=8, max_in_flight=3)
+
+    assert all(graph.node[n]['output'] == 2. / (1 + len(graph.node[n]['state'])) for n in leaves)
+    assert sum(server.batch_sizes) == len(leaves)
+    assert max(server.batch_sizes) <= 8
+    assert server.max_in_flight <= 3
+
+
+def test_async_bidder_concurrency(data_features_and_file):
+    features, path = data_features_and_file
+    graph = GraphBuilder(path, features).get_graph()
+    leaves = list(AsyncBidder.get_leaves(graph))
+    client = BarrierScoringClient(n_concurrent=3)
+
+    graph = AsyncBidder(client=client, batch_size=1, max_in_flight=3).compute_bids(graph)
+
+    assert client.max_in_flight == 3
+    assert all(graph.node[n]['output'] == 1. for n in leaves)
+
+
+def test_async_bidder_fused(data_features_and_file):
+    features, path = data_features_and_file
+    client = BarrierScoringClient(n_concurrent=3, timeout=1.)
+    bidder = AsyncBidder(client=client, batch_size=4, max_in_flight=3, max_retries=0)
+
+    graph = GraphBuilder(path, features, bidder=bidder).get_graph()
+    leaves = list(AsyncBidder.get_leaves(graph))
+
+    # the leaves are batched and scored concurrently, not requested one at a time:
+    assert client.max_in_flight == 3
+    assert sum(client.batch_sizes) == len(leaves)
+    assert len(client.batch_sizes) < len(leaves)
+    assert all(graph.node[n]['output'] == 1. for n in leaves)
+
+
+def test_async_bidder_running_loop(data_features_and_file):
+    features, path = data_features_and_file
+    graph = GraphBuilder(path, features).get_graph()
+    bidder = AsyncBidder(client=BarrierScoringClient(n_concurrent=1))
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            bidder.compute_bids(graph)
+        return await bidder.compute_bids_async(graph)
+
+    graph = _run(run())
+
+    assert all(graph.node[n]['output'] == 1. for n in AsyncBidder.get_leaves(graph))
+
+
+def test_async_bidder_producer_fails(data_features_and_file):
+    features, path = data_features_and_file
+    graph = GraphBuilder(path, features).get_graph()
+
+    def get_leaves(graph):
+        yield next(AsyncBidder.get_leaves(graph))
+        raise KeyError('broken leaf')
+
+    bidder = AsyncBidder(client=BarrierScoringClient(n_concurrent=1))
+    bidder.get_leaves = get_leaves
+
+    with pytest.raises(KeyError):
+        bidder.compute_bids(graph)
+
+
+def test_async_bidder_retries(data_features_and_file):
+    features, path = data_features_and_file
+    graph = GraphBuilder(path, features).get_graph()
+    leaves = list(AsyncBidder.get_leaves(graph))
+
+    graph, _ = _run_against_server(graph, batch_size=1000, failures=2, retry_delay=0.001)
+
+    assert all('output' in graph.node[n] for n in leaves)
+
+
+def test_async_bidder_gives_up(data_features_and_file):
+    features, path = data_features_and_file
+    graph = GraphBuilder(path, features).get_graph()
+
+    with pytest.raises(ConnectionError):
+        _run_against_server(graph, failures=100, max_retries=2, retry_delay=0.001)
@@ -5,12 +5,16 @@ from __future__ import (
     absolute_import, unicode_literals
 )
 
-from collections import deque
+from collections import deque, OrderedDict
+import gzip
+import io
 import networkx as nx
+import numpy as np
 import pytest
 import re
 
 from bonspy import BonsaiTree
+from bonspy.writer import write_bonsai
 
 
 def test_switch_header(graph):
@@ -20,7 +24,7 @@ def test_switch_header(graph):
                            set(d.get('split').values()) == {'segment.age'}]
 
     assert len(switch_header_nodes) == 1
-    assert all([d.get('switch_header') is not None for d in switch_header_nodes])
+    assert sum(row.startswith('switch ') for row in text) == 1
 
     for row in text:
         if '.age' in row and 'segment[67890]' in row:
@@ -30,19 +34,39 @@ def test_switch_header(graph):
             assert 'elif' in row or 'if' in row
 
 
-def test_switch_indent(graph):
-    tree = BonsaiTree(graph)
+def _get_indent(row):
+    return len(row) - len(row.lstrip('\t'))
+
 
-    switch_header_nodes = [n for n, d in tree.nodes_iter(data=True) if d.get('split') == 'segment.age']
+def _get_switch_blocks(text):
+    """
+    :return: List of tuples (switch header row, rows of its cases and defaults, rows below those).
+    """
+    rows = text.split('\n')
+    blocks = []
+    for index, row in enumerate(rows):
+        if row.lstrip('\t').startswith('switch '):
+            header_indent = _get_indent(row)
+            body = []
+            for next_row in rows[index + 1:]:
+                if not next_row or _get_indent(next_row) <= header_indent:
+                    break
+                body.append(next_row)
+            cases = [r for r in body if _get_indent(r) == header_indent + 1]
+            below = [r for r in body if _get_indent(r) > header_indent + 1]
+            blocks.append((row, cases, below))
+    return blocks
 
-    for node in switch_header_nodes:
-        node_indent = tree.node[node]['indent'].count('\t')
-        header_indent = tree.node[node]['switch_header'].count('\t')
 
-        children_indent = [tree.node[c]['indent'].count('\t') for c in tree.successors_iter(node)]
+def test_switch_indent(graph):
+    tree = BonsaiTree(graph)
+    blocks = _get_switch_blocks(tree.bonsai)
 
-        assert node_indent - 1 == header_indent
-        assert all([header_indent + 2 == child_indent for child_indent in children_indent])
+    assert blocks
+    for header, cases, below in blocks:
+        assert cases
+        assert all(re.match(r'^\t*(case \(.*\)|default):$', row) for row in cases)
+        assert all(_get_indent(row) >= _get_indent(header) + 2 for row in below)
 
 
 def test_compound_feature_presence(graph):
@@ -126,15 +150,14 @@ def test_get_range_output_for_finite_boundary_points(graph):
 def test_two_range_features(graph_two_range_features):
     tree = BonsaiTree(graph_two_range_features)
 
-    switch_nodes = [n for n, d in tree.nodes_iter(data=True) if d.get('switch_header')]
+    rows = tree.bonsai.split('\n')
 
-    for node in switch_nodes:
-        parent = tree.predecessors(node)[0]
+    for index, row in enumerate(rows):
+        if row.lstrip('\t').startswith('switch '):
+            parent_row = next(r for r in reversed(rows[:index]) if _get_indent(r) < _get_indent(row))
 
-        header_indent = tree.node[node]['switch_header'].count('\t')
-        parent_indent = tree.node[parent]['indent'].count('\t')
-
-        assert header_indent - 1 == parent_indent
+            assert _get_indent(row) - 1 == _get_indent(parent_row)
+            assert parent_row.rstrip().endswith(':')
 
 
 def test_feature_validation(graph_two_range_features):
@@ -505,3 +528,170 @@ def test_feature_slicer_mixed_split(small_unsliced_graph_mixed_split):
     assert all(['slice_feature' not in tree.node[n].get('split', dict()).values() for n in tree.node])
     assert 'output' not in tree.node[0]
     assert tree.node['default_one']['output'] == 5.
+
+
+def test_tree_index(unsliced_graph, graph):
+    sliced = BonsaiTree(
+        unsliced_graph,
+        slice_features=('slice_feature',),
+        slice_feature_values={'slice_feature': 'good'}
+    )
+
+    for tree in [sliced, BonsaiTree(graph)]:
+        root = tree._get_root()
+
+        assert not tree.pred[root]
+        assert {n: tree.predecessors(n)[0] for n in tree.nodes_iter() if n != root} == tree._parents
+        assert not tree._get_disconnected_nodes()
+
+
+def test_from_graph_without_copy(graph):
+    expected = BonsaiTree(graph.copy(), feature_order=['segment'])
+    node_data = {n: d for n, d in graph.nodes_iter(data=True)}
+
+    tree = BonsaiTree.from_graph(graph, copy=False, feature_order=['segment'])
+
+    assert tree.bonsai == expected.bonsai
+    assert len(graph) == 0
+    assert all(tree.node[n] is node_data[n] for n in tree.nodes_iter())
+
+    with pytest.raises(ValueError):
+        BonsaiTree.from_graph(nx.MultiDiGraph(), copy=False)
+
+
+def test_lazy_bonsai(graph):
+    tree = BonsaiTree(graph)
+
+    assert tree._bonsai is None
+
+    text = tree.bonsai
+    assert tree.bonsai is text
+    assert tree.bonsai_encoded is tree.bonsai_encoded
+
+    tree.node[next(n for n, d in tree.nodes_iter(data=True) if d.get('is_leaf'))]['output'] = 0.4321
+    assert tree.bonsai is text
+
+    tree.invalidate_bonsai()
+    assert '0.4321' in tree.bonsai and '0.4321' not in text
+
+
+def test_bonsai_invalidated_by_mutation(graph):
+    tree = BonsaiTree(graph)
+    text = tree.bonsai
+    encoded = tree.bonsai_encoded
+
+    leaf = next(
+        n for n, d in tree.nodes_iter(data=True) if d.get('is_leaf') and len(tree.succ[tree.predecessors(n)[0]]) > 2
+    )
+    tree.remove_node(leaf)
+
+    assert tree.bonsai != text
+    assert tree.bonsai_encoded != encoded
+    assert tree.bonsai.count('\n') == text.count('\n') - 2
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_write(graph, cached):
+    tree = BonsaiTree(graph)
+    text = BonsaiTree(graph).bonsai
+    if cached:
+        assert tree.bonsai == text
+
+    fps = {encoding: io.BytesIO() for encoding in ('text', 'base64', 'gzip')}
+    for encoding, fp in fps.items():
+        tree.write(fp, encoding=encoding)
+    assert (tree._bonsai is not None) is cached  # writing does not cache the text
+
+    assert fps['text'].getvalue().decode('ascii') == text
+    assert fps['base64'].getvalue().decode('ascii') == tree.bonsai_encoded
+    assert gzip.GzipFile(fileobj=io.BytesIO(fps['gzip'].getvalue())).read().decode('ascii') == text
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 4, 7, 64])
+def test_write_bonsai_chunks(graph, chunk_size):
+    tree = BonsaiTree(graph)
+    fp = io.BytesIO()
+    write_bonsai(tree._tree_to_bonsai(), fp, encoding='base64', chunk_size=chunk_size)
+
+    assert fp.getvalue().decode('ascii') == tree.bonsai_encoded
+
+    with pytest.raises(ValueError):
+        write_bonsai([], io.BytesIO(), encoding='utf-8')
+
+
+def test_condition_fragments(graph):
+    tree = BonsaiTree(graph)
+    text = tree.bonsai
+
+    membership = tree._get_if_conditional(['UK', 'DE'], 'membership', 'geo', False)
+    assert membership == 'geo in ("UK","DE")'
+    assert tree._get_if_conditional(['UK', 'DE'], 'membership', 'geo', False) is membership
+    assert tree._get_if_conditional(('UK', 'DE'), 'membership', 'geo', False) is membership  # interned
+    assert text.count(membership + ':') > 1
+
+    assert tree._get_if_conditional(1, 'assignment', 'os', False) == 'os=1'
+    assert tree._get_if_conditional(1., 'assignment', 'os', False) == 'os=1.0'
+    assert tree._get_switch_header_range_statement('\t', (0, 10)) == '\tcase (0 .. 10):\n'
+    assert tree._get_switch_header_range_statement('', (0., 10.)) == 'case (0.0 .. 10.0):\n'
+
+
+def test_invalidate_bonsai_sibling_order():
+    g = nx.DiGraph()
+    g.add_node(0, split='os', state=OrderedDict())
+    g.add_node(1, is_leaf=True, output=.1, state=OrderedDict([('os', 'linux')]))
+    g.add_node(2, is_leaf=True, output=.2, state=OrderedDict([('os', 'osx')]))
+    g.add_node(3, is_default_leaf=True, output=.3, state=OrderedDict())
+    g.add_edge(0, 1, value='linux', type='assignment')
+    g.add_edge(0, 2, value='osx', type='assignment')
+    g.add_edge(0, 3)
+
+    tree = BonsaiTree(g, feature_value_order={'os': ['linux', 'osx']})
+    assert tree.bonsai.startswith('if os="linux":')
+
+    tree.node[1]['state'] = OrderedDict([('os', 'windows')])  # not in `feature_value_order`, so goes last
+    tree.edge[0][1]['value'] = 'windows'
+    tree.invalidate_bonsai()
+
+    assert tree.bonsai.startswith('if os="osx":\n\t0.2000\nelif os="windows":')
+
+
+def test_sibling_order_unequal_state_lengths():
+    g = nx.DiGraph()
+    g.add_node(0, split='segment', state=OrderedDict([('os', 'linux')]))
+    g.add_node(2, is_leaf=True, output=.2, state=OrderedDict([('os', 'linux')]))
+    g.add_node(3, is_leaf=True, output=.3, state=OrderedDict([('os', 'linux'), ('segment', 3)]))
+    g.add_node(4, is_leaf=True, output=.4, state=OrderedDict([('os', 'linux'), ('segment', 4)]))
+    g.add_node(5, is_default_leaf=True, output=.1, state=OrderedDict([('os', 'linux')]))
+    for child in (4, 3, 2):
+        g.add_edge(0, child, value=child, type='assignment')
+    g.add_edge(0, 5)
+
+    tree = BonsaiTree(g, feature_value_order={'segment': [3, 2, 1]})
+
+    # the shorter state of 2 ties with both siblings, which are still ordered by their segments:
+    assert re.findall(r'segment\[(\d)\]', tree.bonsai) == ['3', '4', '2']
+
+
+def test_leaf_output_fragments():
+    outputs = [0., -0., 0, 1, 1., True, .1, np.float32(.1), -.00001, float('nan'), None, 0.]
+
+    g = nx.DiGraph()
+    g.add_node(0, split='os', state=OrderedDict())
+    for leaf, output in enumerate(outputs, 1):
+        g.add_node(leaf, is_leaf=True, output=output, state=OrderedDict([('os', str(leaf))]))
+        g.add_edge(0, leaf, value=str(leaf), type='assignment')
+    tree = BonsaiTree(g, feature_value_order={'os': [str(leaf) for leaf in g.successors(0)]})
+
+    expected = [BonsaiTree._format_leaf_output(output) for output in outputs]
+    assert [line.strip() + '\n' for line in tree.bonsai.splitlines()[1::2]] == expected
+    assert '\t-0.0000\n' in tree.bonsai
+
+
+def test_bare_renderer_fragments():
+    renderer = BonsaiTree()
+
+    fragment = renderer._get_if_conditional(['UK', 'DE'], 'membership', 'geo', False)
+
+    assert renderer._fragments
+    assert renderer._get_if_conditional(['UK', 'DE'], 'membership', 'geo', False) is fragment
+    assert renderer._get_if_conditional([['UK']], 'membership', 'geo', False) == 'geo in ([\'UK\'],)'
@@ -0,0 +1,142 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from bonspy import BonsaiTree
+from bonspy.columnar import aggregate_subtrees, get_leaf_table, set_leaf_values
+from bonspy.graph_builder import ConstantBidder, GraphBuilder
+
+
+def test_leaf_table_graph_builder(data_features_and_file):
+    features, path = data_features_and_file
+    graph = GraphBuilder(path, features, lazy_formatters=(('user_day', int), )).get_graph()
+
+    table = get_leaf_table(graph)
+    leaves = [n for n in graph.node if graph.out_degree(n) == 0]
+
+    assert sorted(table['leaf'].tolist()) == sorted(leaves)
+    assert list(table) == ['leaf', 'is_default_leaf'] + features
+    assert table['is_default_leaf'].sum() == len([n for n in leaves if graph.node[n].get('is_default_leaf')])
+    for i, leaf in enumerate(table['leaf']):
+        for feature in features:
+            assert table[feature][i] == graph.node[leaf]['state'].get(feature)
+
+
+def test_leaf_table_round_trip(data_features_and_file):
+    features, path = data_features_and_file
+    graph = GraphBuilder(path, features).get_graph()
+    expected = ConstantBidder(bid=1.).compute_bids(graph.copy())
+
+    table = get_leaf_table(graph, features=['country'])
+    outputs = np.ones(len(table['leaf']))
+    graph = set_leaf_values(graph, table['leaf'], outputs)
+
+    assert all(graph.node[n].get('output') == expected.node[n].get('output') for n in graph.node)
+    assert all(type(graph.node[n]['output']) is float for n in table['leaf'])
+
+    with pytest.raises(ValueError):
+        set_leaf_values(graph, table['leaf'], outputs[1:])
+
+
+def test_bonsai_tree_leaf_table(graph):
+    tree = BonsaiTree(graph)
+    table = tree.get_leaf_table()
+
+    assert table['leaf'].tolist() == get_leaf_table(tree)['leaf'].tolist()
+
+    tree.set_leaf_values(table['leaf'], np.full(len(table['leaf']), 0.4321))
+
+    assert tree.bonsai.count('0.4321') == len(table['leaf']) - tree.bonsai.count('value:')
+
+
+def test_leaf_table_as_frame(graph):
+    pd = pytest.importorskip('pandas')
+
+    tree = BonsaiTree(graph)
+    frame = tree.get_leaf_table(as_frame=True)
+
+    assert isinstance(frame, pd.DataFrame)
+    assert frame['leaf'].tolist() == tree.get_leaf_table()['leaf'].tolist()
+
+
+def test_set_leaf_values_nan(graph):
+    tree = BonsaiTree(graph)
+    table = tree.get_leaf_table()
+    outputs = np.full(len(table['leaf']), np.nan)
+    outputs[::2] = .4321
+
+    tree.set_leaf_values(table['leaf'], outputs)
+
+    assert all(tree.node[leaf]['output'] is None for leaf in table['leaf'][1::2].tolist())
+    assert 'nan' not in tree.bonsai
+    assert 'no_bid' in tree.bonsai
+
+
+def test_aggregate_subtrees(data_features_and_file):
+    features, path = data_features_and_file
+
+    def events_counter(node_dict, *args):
+        node_dict['events'] = node_dict.get('events', 0) + 1
+        return node_dict
+
+    graph = GraphBuilder(path, features, functions=(events_counter, )).get_graph()
+    for n in graph.node:
+        graph.node[n]['output'] = float(n)
+
+    table = aggregate_subtrees(graph, sums=('events', ), mins=('output', ), maxs=('output', ))
+
+    for n in graph.node:
+        subtree = nx.descendants(graph, n) | {n}
+        leaves = [m for m in subtree if graph.out_degree(m) == 0]
+
+        assert graph.node[n]['subtree_leaf_count'] == len(leaves)
+        assert graph.node[n]['subtree_sum_events'] == sum(graph.node[m].get('events', 0) for m in leaves)
+        assert graph.node[n]['subtree_min_output'] == min(float(m) for m in leaves)
+        assert graph.node[n]['subtree_max_output'] == max(float(m) for m in leaves)
+
+    assert table['sum_events'][0] == graph.node[0]['events']
+    assert table['leaf_count'][0] == len(list(get_leaf_table(graph)['leaf']))
+
+
+def test_aggregate_subtrees_deep_chain():
+    depth = 5000
+    graph = nx.DiGraph()
+    graph.add_path(range(depth))
+    graph.node[depth - 1]['clicks'] = 3
+
+    table = aggregate_subtrees(graph, sums=('clicks', ), mins=('output', ), leaves_only=False, store=False)
+
+    assert table['sum_clicks'].tolist() == depth * [3]
+    assert table['leaf_count'].tolist() == depth * [1]
+    assert np.isnan(table['min_output']).all()
+    assert 'subtree_sum_clicks' not in graph.node[0]
+
+
+def test_aggregate_subtrees_infinite_and_missing_outputs():
+    graph = nx.DiGraph()
+    graph.add_edges_from([(0, 1), (0, 2), (1, 3), (1, 4), (2, 5), (2, 6)])
+    outputs = {3: np.inf, 4: np.inf, 5: None, 6: 1.5}
+    for leaf, output in outputs.items():
+        graph.node[leaf]['output'] = output
+
+    table = aggregate_subtrees(graph, sums=('output', ), mins=('output', ), maxs=('output', ), store=False)
+    position = {node: i for i, node in enumerate(table['node'].tolist())}
+
+    assert table['min_output'][position[1]] == np.inf
+    assert table['max_output'][position[0]] == np.inf
+    assert table['min_output'][position[2]] == table['max_output'][position[2]] == 1.5
+    assert np.isnan(table['min_output'][position[5]])
+    assert table['sum_output'][position[2]] == 1.5
+    assert table['sum_output'][position[5]] == 0
+
+
+def test_aggregate_subtrees_no_bid_leaves(graph):
+    tree = BonsaiTree(graph)
+    table = tree.get_leaf_table()
+    outputs = [None if i % 2 else 1. for i in range(len(table['leaf']))]
+    tree.set_leaf_values(table['leaf'], outputs)
+
+    aggregates = aggregate_subtrees(tree, sums=('output', ), maxs=('output', ), store=False)
+
+    assert aggregates['sum_output'][0] == outputs.count(1.)
+    assert aggregates['max_output'][0] == 1.
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (
+    print_function, division, generators,
+    absolute_import, unicode_literals
+)
+
+import numpy as np
+import pytest
+
+from bonspy import BonsaiTree, DecisionTreeConverter
+
+
+class FakeTree:
+
+    def __init__(self, children_left, children_right, feature, threshold, value):
+        self.children_left = np.array(children_left)
+        self.children_right = np.array(children_right)
+        self.feature = np.array(feature)
+        self.threshold = np.array(threshold, dtype=float)
+        self.value = np.array(value, dtype=float)
+
+
+def _predict(g, row):
+    node = 0
+    while g.succ[node]:
+        node = next(
+            (child for child, edge in g.succ[node].items() if 'value' in edge and _matches(edge, row)),
+            next(child for child, edge in g.succ[node].items() if 'value' not in edge)
+        )
+    return g.node[node]['output']
+
+
+def _matches(edge, row):
+    feature = next(iter(edge['feature']))
+    value = row.get(feature)
+    if value is None:
+        return False
+    if edge['type'] == 'range':
+        lower, upper = edge['value']
+        return (lower is None or value >= lower) and (upper is None or value <= upper)
+    return value == edge['value']
+
+
+def _label_edges(g):
+    for parent, child, data in g.edges_iter(data=True):
+        if 'value' in data:
+            data['feature'] = {g.node[parent]['split']}
+
+
+@pytest.fixture
+def fake_tree():
+    # 0: user_hour <= 11.5 ? 1 : 4
+    # 1: segment=12345 ? 3 : 2
+    # 4: user_hour <= 17.5 ? 5 : 6
+    return FakeTree(
+        children_left=[1, 2, -1, -1, 5, -1, -1],
+        children_right=[4, 3, -1, -1, 6, -1, -1],
+        feature=[1, 0, -2, -2, 1, -2, -2],
+        threshold=[11.5, .5, -2, -2, 17.5, -2, -2],
+        value=[[[6, 4]], [[4, 1]], [[3, 0]], [[1, 1]], [[2, 3]], [[0, 2]], [[2, 1]]]
+    )
+
+
+def test_decision_tree_converter(fake_tree):
+    conv = DecisionTreeConverter(fake_tree, ['segment=12345', 'user_hour'], base_bid=2.)
+    g = conv.graph
+    _label_edges(g)
+
+    assert _predict(g, {'user_hour': 3, 'segment': '12345'}) == 1.
+    assert _predict(g, {'user_hour': 3, 'segment': '67890'}) == 0.
+    assert _predict(g, {'user_hour': 14}) == 2.
+    assert _predict(g, {'user_hour': 23}) == pytest.approx(2. / 3.)
+    assert _predict(g, {}) == .8
+
+    assert g.edge[4][5]['value'] == (12, 17)
+    assert g.node[6]['state'] == {'user_hour': (18, None)}
+    assert g.node[2].get('is_default_leaf')
+
+    text = BonsaiTree(g).bonsai
+    assert text.startswith('switch user_hour:\n\tcase ( .. 11):\n\t\tif segment[12345]:\n')
+    assert 'case (12 .. 17):' in text and 'case (18 .. ):' in text
+
+
+def test_from_forest(fake_tree):
+    converters = DecisionTreeConverter.from_forest([fake_tree, fake_tree], ['segment=12345', 'user_hour'])
+
+    assert len(converters) == 2
+    assert all(sorted(conv.graph.nodes()) == list(range(7 + 2)) for conv in converters)
+
+
+def test_sklearn_decision_tree():
+    pytest.importorskip('sklearn')
+    from sklearn.feature_extraction import DictVectorizer
+    from sklearn.tree import DecisionTreeClassifier
+
+    random = np.random.RandomState(0)
+    rows = [
+        {'segment': str(random.choice([1, 2, 3])), 'geo': random.choice(['UK', 'DE', 'US']),
+         'user_hour': int(random.randint(24))}
+        for _ in range(2000)
+    ]
+    labels = [
+        random.rand() < (.2 + .3 * (row['geo'] == 'UK') + .3 * (row['user_hour'] > 12) + .1 * (row['segment'] == '2'))
+        for row in rows
+    ]
+
+    vectorizer = DictVectorizer()
+    X = vectorizer.fit_transform(rows)
+    model = DecisionTreeClassifier(max_depth=6, random_state=0).fit(X, labels)
+
+    g = DecisionTreeConverter(model, vectorizer.feature_names_, base_bid=3.).graph
+    BonsaiTree(g.copy())
+    _label_edges(g)
+
+    expected = 3. * model.predict_proba(X)[:, 1]
+    for row, bid in zip(rows[:200], expected):
+        assert _predict(g, row) == pytest.approx(bid)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (
+    print_function, division, generators,
+    absolute_import, unicode_literals
+)
+
+import numpy as np
+import pytest
+
+from bonspy import BonsaiTree, EnsembleCompiler
+from bonspy.tests.test_decision_tree import FakeTree
+
+
+def _stump(column, threshold, left_value, right_value, left_samples=1, right_samples=1):
+    tree = FakeTree(
+        children_left=[1, -1, -1],
+        children_right=[2, -1, -1],
+        feature=[column, -2, -2],
+        threshold=[threshold, -2, -2],
+        value=[[[0.]], [[left_value]], [[right_value]]]
+    )
+    tree.weighted_n_node_samples = np.array([left_samples + right_samples, left_samples, right_samples], dtype=float)
+    return tree
+
+
+@pytest.fixture
+def stumps():
+    feature_names = ['segment=1', 'segment=2', 'user_hour']
+    trees = [
+        _stump(2, 11.5, -.1, .1),
+        _stump(0, .5, 0., 1.),
+        _stump(1, .5, -.5, .5, left_samples=3),
+        _stump(2, 5.5, 0., .01),
+    ]
+    X = np.array([[s1, s2, hour] for s1, s2 in ((1, 0), (0, 1), (0, 0)) for hour in range(24)], dtype=float)
+    return trees, feature_names, X
+
+
+def test_ensemble_compiler_exact(stumps):
+    trees, feature_names, X = stumps
+    compiler = EnsembleCompiler(trees, feature_names, intercept=-1., base_bid=2.)
+
+    assert sorted(compiler.merged) == [0, 1, 2, 3]
+    assert compiler.merged[:2] == [1, 2]
+    assert compiler.get_bid_error(X)['max'] == pytest.approx(0.)
+
+    # segment=2 is only split on where segment=1 is not set:
+    g = compiler.graph
+    assert not any(
+        g.node[n]['state'].get('segment') == '1' and g.node[n].get('split') == 'segment' for n in g.nodes()
+    )
+    assert ''.join(BonsaiTree(g).bonsai).count('segment[2]') == 1
+
+
+def test_ensemble_compiler_budget(stumps):
+    trees, feature_names, X = stumps
+    full = EnsembleCompiler(trees, feature_names, intercept=-1., base_bid=2.)
+    compiler = EnsembleCompiler(trees, feature_names, intercept=-1., base_bid=2., max_nodes=6)
+
+    assert len(compiler.graph) <= 6 < len(full.graph)
+    assert compiler.merged == [1, 2]
+
+    # the user_hour stumps contribute their expected values of (-.1 + .1) / 2 and (0 + .01) / 2:
+    raw = -1. + 1. - .5 + 0. + .005
+    assert compiler.predict(np.array([[1, 0, 3.]]))[0] == pytest.approx(2. / (1. + np.exp(-raw)))
+    assert 0. < compiler.get_bid_error(X)['max'] < 2.
+
+    with pytest.raises(ValueError):
+        EnsembleCompiler(trees, feature_names, link='probit')
+
+
+def test_gradient_boosting():
+    pytest.importorskip('sklearn')
+    from sklearn.ensemble import GradientBoostingClassifier, RandomForestRegressor
+    from sklearn.feature_extraction import DictVectorizer
+
+    random = np.random.RandomState(0)
+    rows = [
+        {'segment': str(random.choice([1, 2, 3])), 'geo': random.choice(['UK', 'DE', 'US']),
+         'user_hour': int(random.randint(24))}
+        for _ in range(1000)
+    ]
+    labels = [
+        random.rand() < (.2 + .3 * (row['geo'] == 'UK') + .3 * (row['user_hour'] > 12) + .1 * (row['segment'] == '2'))
+        for row in rows
+    ]
+    vectorizer = DictVectorizer()
+    X = vectorizer.fit_transform(rows)
+
+    model = GradientBoostingClassifier(n_estimators=20, max_depth=2, random_state=0).fit(X, labels)
+    compiler = EnsembleCompiler.from_gradient_boosting(model, vectorizer.feature_names_, X, base_bid=2.)
+
+    assert np.allclose(compiler.predict_ensemble(X), 2. * model.predict_proba(X)[:, 1])
+    assert compiler.get_bid_error(X)['max'] == pytest.approx(0., abs=1e-9)
+
+    small = EnsembleCompiler.from_gradient_boosting(model, vectorizer.feature_names_, X, base_bid=2., max_nodes=30)
+    error = small.get_bid_error(X)
+
+    assert len(small.graph) <= 30
+    assert 0. < error['mean'] <= error['max']
+    BonsaiTree(small.graph)
+
+    forest = RandomForestRegressor(n_estimators=3, max_depth=3, random_state=0).fit(X, labels)
+    compiler = EnsembleCompiler.from_forest(forest, vectorizer.feature_names_)
+
+    assert np.allclose(compiler.predict_ensemble(X), forest.predict(X))
@@ -1,4 +1,7 @@
-from bonspy.features import _apply_operations
+import numpy as np
+
+from bonspy import features
+from bonspy.features import _apply_operations, get_validated, get_validated_array, get_validator
 
 
 def test_apply_operations_domain():
@@ -17,3 +20,42 @@ def test_apply_operations_segment():
     value = _apply_operations('segment', 1)
 
     assert value == 1
+
+
+def test_get_validated():
+    assert get_validated('user_hour', 30) == 23
+    assert get_validated('segment.age', (-5, 10.7)) == (0, 10)
+    assert get_validated('segment.value', [None, 0]) == [None, 1]
+    assert get_validated('user_hour', float('inf')) == 23
+    assert get_validated('segment.age', float('-inf')) == 0
+    assert get_validated('domain', 'www.test.com') == 'test.com'
+    assert get_validator('geo') is get_validator('geo')
+
+
+def test_get_validated_memoized():
+    validate = get_validator('price')
+
+    assert type(validate(1.0)) is float and type(validate(1)) is int
+    assert validate([1, 2]) == [1, 2]  # unhashable values are validated without the memo
+
+
+def test_get_validated_table_changes(monkeypatch):
+    assert get_validated('user_hour', 30) == 23
+
+    monkeypatch.setitem(features.CEILINGS, 'user_hour', 20)
+    monkeypatch.setitem(features.OPERATIONS, 'user_hour', [lambda value: value + 100])
+
+    assert get_validated('user_hour', 30) == 120
+
+    monkeypatch.undo()
+
+    assert get_validated('user_hour', 30) == 23
+
+
+def test_get_validated_array():
+    values = np.array([-3., 5.7, 30., 12.])
+
+    assert get_validated_array('user_hour', values).tolist() == [0, 5, 23, 12]
+    assert get_validated_array('price', values) is values
+    assert get_validated_array('segment.age', [1., np.inf]).tolist() == [1, np.inf]
+    assert get_validated_array('domain', ['www.test.com', None]).tolist() == ['test.com', None]
@@ -1,6 +1,9 @@
 import gzip
 from unittest.mock import Mock
 from random import random
+
+import pytest
+
 from bonspy.graph_builder import GraphBuilder, ConstantBidder, EstimatorBidder
 
 
@@ -85,3 +88,104 @@ def test_estimator_bidder(data_features_and_file):
     leaves = [n for n in graph.node if graph.out_degree(n) == 0]
 
     assert all([2.5 <= graph.node[n]['output'] <= 5. for n in leaves])
+
+
+def _leaf_outputs(graph):
+    return sorted(
+        (tuple(graph.node[n]['state'].items()), graph.node[n].get('is_default_leaf', False), graph.node[n]['output'])
+        for n in graph.node if graph.out_degree(n) == 0
+    )
+
+
+def test_graph_builder_fused_bidder(data_features_and_file):
+    features, path = data_features_and_file
+    bidder = EstimatorBidder(base_bid=5., estimators=(_length_estimator(), ))
+
+    graph = bidder.compute_bids(GraphBuilder(path, features).get_graph())
+    fused_graph = GraphBuilder(path, features, bidder=bidder).get_graph()
+
+    assert _leaf_outputs(fused_graph) == _leaf_outputs(graph)
+
+
+def _sort_input(path, tmpdir):
+    sorted_path = str(tmpdir.join('sorted.csv.gz'))
+
+    with gzip.open(path, 'rt') as file:
+        header, *rows = file.readlines()
+    rows = sorted(rows, key=lambda row: row.split(','))
+    with gzip.open(sorted_path, 'wt') as file:
+        file.writelines([header] + rows)
+
+    return sorted_path
+
+
+def test_graph_builder_sorted_input(data_features_and_file, tmpdir):
+    features, path = data_features_and_file
+    sorted_path = _sort_input(path, tmpdir)
+
+    bidder = EstimatorBidder(base_bid=5., estimators=(_length_estimator(), ))
+
+    graph = bidder.compute_bids(GraphBuilder(path, features).get_graph())
+    sorted_graph = GraphBuilder(sorted_path, features, bidder=bidder, sorted_input=True).get_graph()
+
+    assert len(sorted_graph.node) == len(graph.node)
+    assert _leaf_outputs(sorted_graph) == _leaf_outputs(graph)
+
+
+class BatchRecordingBidder(ConstantBidder):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+
+    def bid_leaves(self, graph, leaves):
+        self.batches.append(list(leaves))
+        return super().bid_leaves(graph, leaves)
+
+
+@pytest.mark.parametrize('sorted_input', [False, True])
+def test_graph_builder_bids_in_bulk(data_features_and_file, tmpdir, sorted_input):
+    features, path = data_features_and_file
+    if sorted_input:
+        path = _sort_input(path, tmpdir)
+    bidder = BatchRecordingBidder(bid=2.)
+
+    graph = GraphBuilder(path, features, bidder=bidder, sorted_input=sorted_input).get_graph()
+    leaves = [n for n in graph.node if graph.out_degree(n) == 0]
+
+    # one batch for the whole graph, or one per subtree of the root for sorted input:
+    assert len(bidder.batches) == (len(graph.succ[0]) - 1 if sorted_input else 1)
+    assert sorted(leaf for batch in bidder.batches for leaf in batch) == sorted(leaves)
+    assert all(graph.node[n]['output'] == 2. for n in leaves)
+
+
+def test_graph_builder_sorted_input_unsorted(small_data_features_and_file):
+    features, path = small_data_features_and_file
+    builder = GraphBuilder(path, features, sorted_input=True)
+
+    with pytest.raises(ValueError):
+        builder.get_graph()
+
+
+def _length_estimator():
+    estimator = Mock()
+    estimator.dict_vectorizer = lambda x, **kwargs: x
+    estimator.predict = lambda x: 1. / (1 + len(x))
+    return estimator
+
+
+def test_graph_builder_formatter_cache(data_features_and_file):
+    features, path = data_features_and_file
+    builder = GraphBuilder(path, features, lazy_formatters=(('user_day', int), ), formatter_cache_size=4)
+    graph = builder.get_graph()
+
+    values = {}
+    for node in graph.node:
+        for feature, value in graph.node[node]['state'].items():
+            assert values.setdefault((feature, value), value) is value
+
+    info = builder.formatter_cache_info()
+
+    assert set(info) == set(features)
+    assert all(0. < i['hit_rate'] < 1. for i in info.values())
+    assert all(i['hits'] + i['misses'] >= 50 and i['currsize'] <= 4 for i in info.values())
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (
+    print_function, division, generators,
+    absolute_import, unicode_literals
+)
+
+import io
+import math
+
+import numpy as np
+import pytest
+
+from bonspy import BonsaiTree, LogisticConverter
+
+
+def test_iter_bonsai(logistic_converter_kwargs):
+    conv = LogisticConverter(**logistic_converter_kwargs)
+    tree = BonsaiTree(conv.graph)
+
+    assert ''.join(conv.iter_bonsai()) == tree.bonsai
+
+
+def test_iter_bonsai_without_graph(logistic_converter_kwargs):
+    conv = LogisticConverter(build_graph=False, **logistic_converter_kwargs)
+    text = ''.join(conv.iter_bonsai())
+
+    assert conv.graph is None
+    assert text == BonsaiTree(LogisticConverter(**logistic_converter_kwargs).graph).bonsai
+    assert text.startswith('if segment[12345]:\n\tswitch segment[12345].age:\n\t\tcase ( .. 10):\n')
+    assert text.count('case (13 .. 23):') == 2 * 2 * 3
+
+
+def test_write(logistic_converter_kwargs):
+    conv = LogisticConverter(build_graph=False, **logistic_converter_kwargs)
+    tree = BonsaiTree(LogisticConverter(**logistic_converter_kwargs).graph)
+    fp = io.BytesIO()
+    conv.write(fp, encoding='base64')
+
+    assert fp.getvalue().decode('ascii') == tree.bonsai_encoded
+
+
+def test_iter_bonsai_single_feature(logistic_converter_kwargs):
+    logistic_converter_kwargs['features'] = ['user_hour']
+    conv = LogisticConverter(**logistic_converter_kwargs)
+
+    assert ''.join(conv.iter_bonsai()) == BonsaiTree(conv.graph).bonsai
+
+
+def test_graph_structure(logistic_converter_kwargs):
+    conv = LogisticConverter(**logistic_converter_kwargs)
+    g = conv.graph
+
+    # 2 segments x 2 ages x 3 geos x 2 hours, each internal node with one default leaf:
+    n_internal = 1 + 2 + 2 * 2 + 2 * 2 * 3
+    n_leaves = 2 * 2 * 3 * 2
+
+    assert sorted(g.nodes()) == list(range(n_internal * 2 + n_leaves))
+    assert len([n for n in g.nodes() if g.node[n].get('is_leaf')]) == n_leaves
+    assert len([n for n in g.nodes() if g.node[n].get('is_default_leaf')]) == n_internal
+    assert all(len(g.node[n]['state']) == 4 for n in g.nodes() if g.node[n].get('is_leaf'))
+    assert g.node[0]['split'] == 'segment'
+
+    leaf = next(n for n in g.nodes() if g.node[n]['state'] == {
+        'segment': '67890', 'segment.age': (10, None), 'geo': 'US', 'user_hour': (13, 30)
+    })
+    expected = 2. / (1. + math.exp(-(.4 + .2 + .25 + .2 - .2)))
+
+    assert g.node[leaf]['output'] == pytest.approx(expected)
+
+
+def test_bids(logistic_converter_kwargs):
+    conv = LogisticConverter(**logistic_converter_kwargs)
+    g = conv.graph
+
+    for n in g.nodes():
+        if g.node[n].get('is_leaf') or g.node[n].get('is_default_leaf'):
+            state = g.node[n]['state']
+            sum_ = .4 + sum(conv.weights[conv.feature_map[f][v]] for f, v in state.items())
+            assert g.node[n]['output'] == conv.bids[n]
+            assert conv.bids[n] == pytest.approx(2. / (1. + math.exp(-sum_)))
+        else:
+            assert math.isnan(conv.bids[n])
+
+
+def _lookup(g, state):
+    node = 0
+    while g.succ[node]:
+        split = g.node[node]['split']
+        node = next(
+            (child for child, edge in g.succ[node].items() if 'value' in edge and edge['value'] == state.get(split)),
+            next(child for child in g.succ[node] if g.node[child].get('is_default_leaf'))
+        )
+    return g.node[node]['output']
+
+
+@pytest.mark.parametrize('min_bid, tolerance', [(1.5, None), (None, .25), (1.45, .22)])
+def test_pruning(logistic_converter_kwargs, min_bid, tolerance):
+    full = LogisticConverter(**logistic_converter_kwargs).graph
+    conv = LogisticConverter(min_bid=min_bid, tolerance=tolerance, **logistic_converter_kwargs)
+    g = conv.graph
+
+    assert len(g) < len(full)
+    assert ''.join(conv.iter_bonsai()) == BonsaiTree(g).bonsai
+
+    for n in full.nodes():
+        if not full.succ[n]:
+            expected = full.node[n]['output']
+            output = _lookup(g, full.node[n]['state'])
+            if output is None:
+                assert expected < min_bid + (tolerance or 0.) / 2.
+            else:
+                assert min_bid is None or output >= min_bid
+                assert output == pytest.approx(expected, abs=(tolerance or 0.) / 2. + 1e-12)
+
+
+def test_pruning_below_floor(logistic_converter_kwargs):
+    conv = LogisticConverter(min_bid=1.35, **logistic_converter_kwargs)
+    text = ''.join(conv.iter_bonsai())
+
+    assert 'no_bid' in text
+    assert text == BonsaiTree(conv.graph).bonsai
+    assert ''.join(LogisticConverter(min_bid=10., **logistic_converter_kwargs).iter_bonsai()) == ''
+
+
+@pytest.mark.parametrize('features', [None, ['user_hour']])
+def test_pruning_keeps_root(logistic_converter_kwargs, features):
+    if features is not None:
+        logistic_converter_kwargs['features'] = features
+    conv = LogisticConverter(tolerance=5., **logistic_converter_kwargs)
+    text = ''.join(conv.iter_bonsai())
+    g = conv.graph
+
+    assert text == BonsaiTree(g).bonsai
+    assert text.startswith('switch ' if features else 'if ')
+    assert g.node[0]['split'] == conv.features[0]
+    # every subtree below the root is pruned to its default leaf:
+    assert all(g.node[m].get('is_default_leaf') for n in g.succ[0] for m in g.succ[n])
+
+
+@pytest.mark.parametrize('min_weight, top_k', [(.15, None), (None, 1), (.12, 2)])
+def test_sparsification(logistic_converter_kwargs, min_weight, top_k):
+    full = LogisticConverter(**logistic_converter_kwargs)
+    conv = LogisticConverter(min_weight=min_weight, top_k=top_k, **logistic_converter_kwargs)
+    g = conv.graph
+
+    for feature, values in conv.feature_map.items():
+        assert len(values) <= (top_k or len(values))
+        assert all(abs(conv.weights[index]) >= (min_weight or 0.) for index in values.values())
+
+    assert len(g) < len(full.graph)
+    assert ''.join(conv.iter_bonsai()) == BonsaiTree(g).bonsai
+    assert conv.max_bid_error > 0.
+    assert full.max_bid_error == 0.
+
+    errors = [
+        abs(_lookup(g, full.graph.node[n]['state']) - full.graph.node[n]['output'])
+        for n in full.graph.nodes() if not full.graph.succ[n]
+    ]
+    assert max(errors) <= conv.max_bid_error + 1e-12
+
+
+def test_sparsification_ties(logistic_converter_kwargs):
+    weights = logistic_converter_kwargs['weights']
+    weights[1] = -weights[0]  # segment=67890
+    weights[8] = -weights[7]  # user_hour=1
+    weights[6] = weights[4]  # geo=US
+
+    conv = LogisticConverter(top_k=1, **logistic_converter_kwargs)
+
+    # ties in magnitude keep the value with the smallest vocabulary index, whatever the hash order:
+    assert {feature: list(values) for feature, values in conv.feature_map.items()} == {
+        'segment': ['12345'], 'segment.age': [(10, None)], 'geo': ['UK'], 'user_hour': [(-1, 12)]
+    }
+
+
+def _get_leaf_bids(conv):
+    g = conv.graph
+    bids = [(sorted(g.node[n]['state'].items(), key=str), g.node[n]['output']) for n in g.nodes() if not g.succ[n]]
+    return sorted(bids, key=str)
+
+
+def test_array_weights_and_feature_names(logistic_converter_kwargs):
+    expected = _get_leaf_bids(LogisticConverter(**logistic_converter_kwargs))
+    vocabulary = logistic_converter_kwargs['vocabulary']
+    weights = logistic_converter_kwargs['weights']
+
+    logistic_converter_kwargs['weights'] = np.array([weights])
+    logistic_converter_kwargs['intercept'] = np.array([.4])
+    conv = LogisticConverter(**logistic_converter_kwargs)
+
+    assert 'domain' not in conv.feature_map
+    assert _get_leaf_bids(conv) == expected
+
+    # `feature_names_` of a DictVectorizer, sorted and with the weights in the same order:
+    names = sorted(vocabulary)
+    logistic_converter_kwargs['vocabulary'] = names
+    logistic_converter_kwargs['weights'] = np.array([[weights[vocabulary[name]] for name in names]])
+
+    assert _get_leaf_bids(LogisticConverter(**logistic_converter_kwargs)) == expected
+
+    logistic_converter_kwargs['vocabulary'] = names[::-1]
+    logistic_converter_kwargs['weights'] = logistic_converter_kwargs['weights'][:, ::-1]
+
+    assert _get_leaf_bids(LogisticConverter(**logistic_converter_kwargs)) == expected
+
+
+def test_vocabulary_value_types(logistic_converter_kwargs):
+    vocabulary = {np.str_(key): index for key, index in logistic_converter_kwargs['vocabulary'].items()}
+    names = sorted(vocabulary, key=vocabulary.get)
+    feature_maps = []
+
+    # dict, unsorted sequence, and sorted sequence of keys:
+    for vocabulary_ in (vocabulary, names, sorted(names)):
+        logistic_converter_kwargs['vocabulary'] = vocabulary_
+        conv = LogisticConverter(build_graph=False, **logistic_converter_kwargs)
+        feature_maps.append({feature: set(map(type, values)) for feature, values in conv.feature_map.items()})
+
+    assert feature_maps[0] == feature_maps[1] == feature_maps[2]
+    assert feature_maps[0]['geo'] == {str}
+
+
+def test_sparse_weights(logistic_converter_kwargs):
+    sparse = pytest.importorskip('scipy.sparse')
+
+    expected = ''.join(LogisticConverter(**logistic_converter_kwargs).iter_bonsai())
+    logistic_converter_kwargs['weights'] = sparse.csr_matrix([logistic_converter_kwargs['weights']])
+
+    assert ''.join(LogisticConverter(**logistic_converter_kwargs).iter_bonsai()) == expected
+
+
+def test_update_weights(logistic_converter_kwargs):
+    conv = LogisticConverter(**logistic_converter_kwargs)
+    weights = list(logistic_converter_kwargs['weights'])
+    weights[6] += .1  # geo=US
+
+    changed = conv.update_weights(weights)
+    logistic_converter_kwargs['weights'] = weights
+    expected = LogisticConverter(**logistic_converter_kwargs)
+
+    g = conv.graph
+    us_leaves = [n for n in g.nodes() if not g.succ[n] and g.node[n]['state'].get('geo') == 'US']
+
+    assert sorted(changed.tolist()) == sorted(us_leaves)
+    assert all(conv.graph.node[n].get('output') == expected.graph.node[n].get('output') for n in conv.graph.nodes())
+    assert ''.join(conv.iter_bonsai()) == ''.join(expected.iter_bonsai())
+
+    assert len(conv.update_weights(weights, base_bid=2.0001, report_tolerance=.001)) == 0
+    assert len(conv.update_weights(weights, base_bid=2.002, report_tolerance=.001)) == len(conv.graph) - 19
+    assert len(conv.update_weights(weights, intercept=.4)) == 0
+
+
+def test_update_weights_rebuild(logistic_converter_kwargs):
+    conv = LogisticConverter(min_bid=1.5, **logistic_converter_kwargs)
+    weights = [w + .1 for w in logistic_converter_kwargs['weights']]
+
+    changed = conv.update_weights(weights)
+    logistic_converter_kwargs['weights'] = weights
+    expected = LogisticConverter(min_bid=1.5, **logistic_converter_kwargs)
+
+    assert len(changed) == len([n for n in conv.graph.nodes() if not conv.graph.succ[n]])
+    assert ''.join(conv.iter_bonsai()) == ''.join(expected.iter_bonsai())
@@ -0,0 +1,64 @@
+import pytest
+
+from bonspy.graph_builder import GraphBuilder
+from bonspy.profiling import FeatureOrderProfiler
+
+
+def test_predicted_size(data_features_and_file):
+    features, path = data_features_and_file
+    builder = GraphBuilder(path, features)
+    profiler = builder.profile_features()
+
+    for order in (features, features[::-1]):
+        size = len(GraphBuilder(path, order).get_graph().node)
+        assert profiler.predicted_size(order) == pytest.approx(size, rel=0.05)
+
+
+def test_optimize_feature_order(small_data_features_and_file):
+    features, path = small_data_features_and_file
+    builder = GraphBuilder(path, features[::-1], types_dict={'os': 'membership'})
+
+    ranking = builder.optimize_feature_order(precision=12)
+
+    assert [order for order, _ in ranking] == [['os', 'city'], ['city', 'os']]
+    assert builder.features == ['os', 'city']
+    assert builder.types_iterable == ('membership', 'assignment')
+    for order, size in ranking:
+        assert size == pytest.approx(len(GraphBuilder(path, order).get_graph().node), rel=0.05)
+
+
+def test_best_order(data_features_and_file):
+    features, path = data_features_and_file
+    builder = GraphBuilder(path, features)
+    profiler = builder.profile_features()
+
+    best_order, best_size = profiler.best_order()
+    ranking = profiler.rank_orders(orders=[features, features[::-1], best_order])
+
+    assert ranking[0][1] == pytest.approx(best_size)
+    assert sorted(best_order) == sorted(features)
+    assert builder.optimize_feature_order(apply=False)[0][1] == pytest.approx(best_size)
+    assert builder.features == features
+
+
+def test_cardinality():
+    rows = [{'a': str(i % 1000), 'b': str(i % 7)} for i in range(20000)]
+    profiler = FeatureOrderProfiler(['a', 'b'], precision=12).update(rows)
+
+    assert profiler.cardinality(['b']) == pytest.approx(7, rel=0.01)
+    assert profiler.cardinality(['a']) == pytest.approx(1000, rel=0.05)
+    assert profiler.cardinality(['a', 'b']) == pytest.approx(7000, rel=0.05)
+
+    with pytest.raises(ValueError):
+        profiler.predicted_size(['a'])
+
+
+def test_cardinality_all_subsets():
+    features = ['a', 'b', 'c', 'd', 'e']
+    rows = [{feature: str(i % (2 + 3 * k)) for k, feature in enumerate(features)} for i in range(3000)]
+    profiler = FeatureOrderProfiler(features, precision=12, chunk_size=256).update(rows)
+
+    for mask in range(1, 2 ** len(features)):
+        subset = [feature for k, feature in enumerate(features) if mask & 1 << k]
+        distinct = len({tuple(row[feature] for feature in subset) for row in rows})
+        assert profiler.cardinality(subset) == pytest.approx(distinct, rel=0.05)
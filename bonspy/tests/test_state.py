@@ -0,0 +1,68 @@
+from collections import OrderedDict
+
+import pytest
+
+from bonspy import BonsaiTree, PathState
+from bonspy.graph_builder import GraphBuilder
+
+
+def test_path_state_mapping():
+    root = PathState()
+    state = root.child('segment', 1).child('age', (None, 10)).child('os', 'linux')
+
+    assert len(root) == 0 and not root
+    assert state.items() == [('segment', 1), ('age', (None, 10)), ('os', 'linux')]
+    assert state['age'] == (None, 10)
+    assert state.get('country') is None
+    assert 'segment' in state and 'country' not in state
+    assert next(reversed(state)) == 'os'
+    assert state == OrderedDict([('segment', 1), ('age', (None, 10)), ('os', 'linux')])
+    assert state == PathState(state.to_dict())
+    assert hash(state) == hash(PathState(state.to_dict()))
+    assert state != state.parent
+
+    with pytest.raises(KeyError):
+        state['country']
+
+
+def test_path_state_shadowing():
+    state = PathState([('age', (None, 20)), ('os', 'linux')]).child('age', (None, 10))
+
+    assert len(state) == 2
+    assert list(state) == ['os', 'age']
+    assert state['age'] == (None, 10)
+
+
+def test_path_state_rewrite():
+    parent = PathState([('segment', 1), ('slice', 'good')])
+    children = [parent.child('os', 'linux'), parent.child('os', 'osx')]
+
+    memo = {}
+    rewritten = [child.rewrite(lambda f, v: None if f == 'slice' else (f, v), memo) for child in children]
+
+    assert rewritten[0].items() == [('segment', 1), ('os', 'linux')]
+    assert rewritten[1].items() == [('segment', 1), ('os', 'osx')]
+    assert rewritten[0].parent is rewritten[1].parent
+    assert children[0].rewrite(lambda f, v: (f, v)) is children[0]
+
+
+def test_graph_states_are_shared(data_features_and_file):
+    features, path = data_features_and_file
+    graph = GraphBuilder(path, features).get_graph()
+
+    for parent, child in graph.edges_iter():
+        state = graph.node[child]['state']
+        assert isinstance(state, PathState)
+        if graph.node[child].get('is_default_leaf'):
+            assert state is graph.node[parent]['state']
+        else:
+            assert state.parent is graph.node[parent]['state']
+
+
+def test_bonsai_tree_path_states(graph):
+    expected = BonsaiTree(graph.copy()).bonsai
+
+    for node in graph.nodes_iter():
+        graph.node[node]['state'] = PathState(graph.node[node]['state'])
+
+    assert BonsaiTree(graph).bonsai == expected
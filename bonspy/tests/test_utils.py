@@ -0,0 +1,10 @@
+import pytest
+
+from bonspy.utils import compare_vectors
+
+
+def test_compare_vectors():
+    with pytest.warns(DeprecationWarning):
+        assert compare_vectors([1, 2], [1, 3]) == -1
+        assert compare_vectors([1, None], [1, 3]) == 1
+        assert compare_vectors([1, 2, 5], [1, 2]) == 0
@@ -1,4 +1,15 @@
+import warnings
+
+
 def compare_vectors(x, y):
+    """
+    Deprecated: `BonsaiTree` sorts children by tuple keys now. Kept for external callers.
+
+    :return: -1, 0, or 1, comparing `x` and `y` item by item on their common prefix,
+        with None ordered after all other values.
+    """
+    warnings.warn('compare_vectors is deprecated and will be removed.', DeprecationWarning, stacklevel=2)
+
     for x_i, y_i in zip(x, y):
         comparison = _compare(x_i, y_i)
         if comparison == 0:
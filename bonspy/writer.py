@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (
+    print_function, division, generators,
+    absolute_import, unicode_literals
+)
+
+import base64
+import gzip
+
+ENCODINGS = ('text', 'base64', 'gzip')
+
+_CHUNK_SIZE = 3 * 2 ** 16  # a multiple of 3, so that base64 chunks concatenate without padding
+
+
+def write_bonsai(lines, fp, encoding='text', chunk_size=_CHUNK_SIZE):
+    """
+    Writes Bonsai text to a binary file object chunk by chunk, so that memory use does not grow
+    with the size of the tree.
+
+    :param lines: iterable of Bonsai text lines, e.g. `LogisticConverter.iter_bonsai()`.
+    :param fp: binary file object, e.g. opened with mode 'wb'.
+    :param encoding: (optional) 'text' for the plain ASCII text, 'base64' for the encoding
+        of `BonsaiTree.bonsai_encoded`, or 'gzip' for gzip compressed text.
+    :param chunk_size: (optional) int, number of text bytes buffered before they are written.
+        Rounded down to a multiple of 3 for base64.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError('Unknown encoding {!r}, expected one of {}.'.format(encoding, ', '.join(ENCODINGS)))
+
+    if encoding == 'gzip':
+        with gzip.GzipFile(fileobj=fp, mode='wb', mtime=0) as gzip_fp:
+            write_bonsai(lines, gzip_fp, chunk_size=chunk_size)
+        return
+
+    if encoding == 'base64':
+        encode = base64.b64encode
+        chunk_size = max(chunk_size - chunk_size % 3, 3)
+    else:
+        encode = bytes
+
+    buffer = bytearray()
+    for line in lines:
+        buffer += line.encode('ascii')
+        if len(buffer) >= chunk_size:
+            end = len(buffer) - len(buffer) % chunk_size
+            for start in range(0, end, chunk_size):
+                fp.write(encode(buffer[start:start + chunk_size]))
+            del buffer[:end]
+
+    if buffer:
+        fp.write(encode(buffer))
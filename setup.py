@@ -15,6 +15,7 @@ setup(
     packages=['bonspy'],
     package_dir={'bonspy': 'bonspy'},
     package_data={'bonspy': ['tests/data/*.csv.gz']},
+    python_requires='>=3.5',
     url='https://github.com/markovianhq/bonspy',
     download_url='https://github.com/markovianhq/bonspy/tarball/master',
     classifiers=[